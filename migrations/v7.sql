@@ -0,0 +1,33 @@
+-- Indexes for ban lookups and player history (/whois, /lastchar).
+-- The event tables are append-only logs, so without these every lookup
+-- by IPID is a full table scan.
+
+-- recent_ooc_names, last_known_name
+CREATE INDEX IF NOT EXISTS room_events_ipid_time
+	ON room_events(ipid, event_time, ooc_name);
+
+-- char_history (event subtype 1 is a character change)
+CREATE INDEX IF NOT EXISTS room_events_ipid_char_time
+	ON room_events(ipid, event_time, char_name)
+	WHERE event_subtype = 1;
+
+-- recent_shownames
+CREATE INDEX IF NOT EXISTS ic_events_ipid_time
+	ON ic_events(ipid, event_time, ic_name);
+
+-- hdid_history
+CREATE INDEX IF NOT EXISTS connect_events_ipid_time
+	ON connect_events(ipid, event_time, hdid);
+
+-- Ban.ipids, Ban.hdids (lookups by IPID/HDID use the primary keys)
+CREATE INDEX IF NOT EXISTS ip_bans_ban_id ON ip_bans(ban_id);
+CREATE INDEX IF NOT EXISTS hdid_bans_ban_id ON hdid_bans(ban_id);
+
+-- schedule_unbans
+CREATE INDEX IF NOT EXISTS bans_pending_unban
+	ON bans(unban_date)
+	WHERE unban_date IS NOT NULL AND unbanned = 0;
+
+ANALYZE;
+
+PRAGMA user_version = 7;
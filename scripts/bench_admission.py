@@ -0,0 +1,89 @@
+"""
+Load test for connection admission: opens thousands of idle sockets to
+a running server, then checks how long a well-behaved client takes to
+complete the handshake while they are held open.
+
+Start a server, then run from the root of the repository:
+    python scripts/bench_admission.py [--host 127.0.0.1] [--port 27016]
+                                      [--sockets N] [--probe-address ADDR]
+"""
+
+import argparse
+import asyncio
+import time
+
+
+async def open_idle(host, port):
+    """Open a socket that never sends anything. Returns the connection,
+    or None if it could not be opened."""
+    try:
+        return await asyncio.open_connection(host, port)
+    except OSError:
+        return None
+
+
+async def is_open(reader):
+    """Whether the server has not closed the connection yet."""
+    try:
+        return await asyncio.wait_for(reader.read(4096), 0.01) != b''
+    except asyncio.TimeoutError:
+        return True
+    except OSError:
+        return False
+
+
+async def handshake(host, port, local_address):
+    """Connect, send HI and wait for the ID packet. Returns the time it
+    took, or None if the server disconnected."""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection(
+        host, port, local_addr=(local_address, 0) if local_address else None)
+    writer.write(b'HI#admission-bench#%')
+    data = b''
+    try:
+        while b'ID#' not in data:
+            chunk = await asyncio.wait_for(reader.read(4096), 10)
+            if chunk == b'':
+                return None
+            data += chunk
+        return time.perf_counter() - start
+    finally:
+        writer.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=27016)
+    parser.add_argument('--sockets', type=int, default=2000)
+    parser.add_argument('--probe-address', default='127.0.0.2',
+                        help='local address of the well-behaved client, so '
+                             'that it is not rate limited with the flood '
+                             '(empty to use the default)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    connections = await asyncio.gather(
+        *[open_idle(args.host, args.port) for _ in range(args.sockets)])
+    connections = [c for c in connections if c is not None]
+    print(f'opened {len(connections)}/{args.sockets} sockets in '
+          f'{time.perf_counter() - start:.2f} s')
+
+    await asyncio.sleep(1)
+    still_open = sum(await asyncio.gather(
+        *[is_open(reader) for reader, _ in connections]))
+    print(f'{still_open} still open after 1 s '
+          f'(the others were turned away by the server)')
+
+    elapsed = await handshake(args.host, args.port, args.probe_address)
+    if elapsed is None:
+        print('handshake: rejected')
+    else:
+        print(f'handshake: {elapsed * 1000:.1f} ms')
+
+    for _, writer in connections:
+        writer.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,155 @@
+"""
+Times /whois-style database lookups on a large synthetic database,
+without and with the indexes added by migrations/v7.sql.
+
+Run from the root of the repository:
+    python scripts/bench_database.py [--rows N] [--ipids N] [--samples N]
+"""
+
+import argparse
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from server import database  # noqa: E402
+
+
+CHARACTERS = ['Phoenix', 'Edgeworth', 'Maya', 'Franziska', 'Godot',
+              'Apollo', 'Athena', 'Gumshoe', 'Larry', 'Pearl']
+BASE_TIME = datetime(2020, 1, 1)
+CHUNK = 100000
+
+
+def v7_indexes():
+    with open('migrations/v7.sql', 'r') as file:
+        return re.findall(r'CREATE INDEX IF NOT EXISTS (\w+)', file.read())
+
+
+def timestamp(i):
+    return (BASE_TIME + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def insert_chunked(conn, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK:
+            conn.executemany(sql, batch)
+            batch.clear()
+    conn.executemany(sql, batch)
+
+
+def fill(db, rows, ipids):
+    """Fill the database with `rows` events spread over `ipids` players."""
+    rng = random.Random(0)
+    conn = db.db
+    conn.execute('PRAGMA foreign_keys = OFF')
+    # char_history expects character changes to be room event subtype 1
+    char = db._subtype_atom('room', 'char')
+    ooc = db._subtype_atom('room', 'ooc')
+    with conn:
+        conn.executemany('INSERT INTO ipids(ipid, ip_address) VALUES (?, ?)',
+                         ((i, f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}')
+                          for i in range(ipids)))
+
+        room_rows = rows // 2
+        insert_chunked(conn, '''
+            INSERT INTO room_events(event_time, ipid, room_name, char_name,
+                ooc_name, event_subtype, message)
+            VALUES (?, ?, 'Lobby', ?, ?, ?, ?)
+            ''', ((timestamp(i), rng.randrange(ipids),
+                   rng.choice(CHARACTERS), f'Player{rng.randrange(50)}',
+                   char if i % 4 == 0 else ooc, 'hello')
+                  for i in range(room_rows)))
+
+        ic_rows = rows * 2 // 5
+        insert_chunked(conn, '''
+            INSERT INTO ic_events(event_time, ipid, room_name, char_name,
+                ic_name, message)
+            VALUES (?, ?, 'Lobby', ?, ?, 'Objection!')
+            ''', ((timestamp(i), rng.randrange(ipids),
+                   rng.choice(CHARACTERS), f'Showname{rng.randrange(50)}')
+                  for i in range(ic_rows)))
+
+        connect_rows = rows - room_rows - ic_rows
+        insert_chunked(conn, '''
+            INSERT INTO connect_events(event_time, ipid, hdid)
+            VALUES (?, ?, ?)
+            ''', ((timestamp(i), ipid, f'hdid{ipid}-{rng.randrange(10)}')
+                  for i, ipid in ((i, rng.randrange(ipids))
+                                  for i in range(connect_rows))))
+
+        for ban_id in range(1, ipids // 100 + 1):
+            conn.execute('INSERT INTO bans(ban_id, reason) VALUES (?, ?)',
+                         (ban_id, 'spam'))
+            conn.execute('INSERT INTO ip_bans(ipid, ban_id) VALUES (?, ?)',
+                         (rng.randrange(ipids), ban_id))
+            conn.execute('INSERT INTO hdid_bans(hdid, ban_id) VALUES (?, ?)',
+                         (f'hdid{rng.randrange(ipids)}-0', ban_id))
+    conn.execute('PRAGMA foreign_keys = ON')
+
+
+def lookups(db, ipid):
+    db.find_ban(ipid=ipid, hdid=f'hdid{ipid}-0')
+    db.last_known_name(ipid)
+    db.recent_ooc_names(ipid)
+    db.recent_shownames(ipid)
+    db.char_history(ipid)
+    db.hdid_history(ipid)
+
+
+def time_lookups(db, sample):
+    start = time.perf_counter()
+    for ipid in sample:
+        lookups(db, ipid)
+    return (time.perf_counter() - start) / len(sample)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000000,
+                        help='number of synthetic log events')
+    parser.add_argument('--ipids', type=int, default=20000,
+                        help='number of distinct players')
+    parser.add_argument('--samples', type=int, default=20,
+                        help='number of players to look up')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        db = database.Database(os.path.join(tmpdir, 'bench.sqlite3'))
+        with db.db as conn:
+            for index in v7_indexes():
+                conn.execute(f'DROP INDEX {index}')
+
+        start = time.perf_counter()
+        fill(db, args.rows, args.ipids)
+        print(f'filled {args.rows} events for {args.ipids} players in '
+              f'{time.perf_counter() - start:.1f} s')
+
+        sample = random.Random(1).sample(range(args.ipids), args.samples)
+        before = time_lookups(db, sample)
+        print(f'{"without indexes":>16}: {before * 1000:10.2f} ms per player')
+
+        start = time.perf_counter()
+        with open('migrations/v7.sql', 'r') as file:
+            db.db.executescript(file.read())
+        print(f'{"v7 migration":>16}: {time.perf_counter() - start:10.2f} s')
+
+        after = time_lookups(db, sample)
+        print(f'{"with indexes":>16}: {after * 1000:10.2f} ms per player '
+              f'({before / after:.0f}x)')
+        db.db.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
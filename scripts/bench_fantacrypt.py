@@ -0,0 +1,71 @@
+"""
+Compares server.fantacrypt against fantacrypt as it was first written,
+one character at a time, on packets of several sizes.
+
+Run from the root of the repository:
+    python scripts/bench_fantacrypt.py [--sizes N [N ...]]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from server.fantacrypt import (  # noqa: E402
+    fanta_decrypt, fanta_encrypt, CRYPT_CONST_1, CRYPT_CONST_2, CRYPT_KEY)
+
+
+def legacy_decrypt(data):
+    """fanta_decrypt before the bytes-based rewrite."""
+    data_bytes = [int(data[x:x + 2], 16) for x in range(0, len(data), 2)]
+    key = CRYPT_KEY
+    ret = ''
+    for byte in data_bytes:
+        val = byte ^ ((key & 0xffff) >> 8)
+        ret += chr(val)
+        key = ((byte + key) * CRYPT_CONST_1) + CRYPT_CONST_2
+    return ret
+
+
+def legacy_encrypt(data):
+    """fanta_encrypt before the bytes-based rewrite."""
+    key = CRYPT_KEY
+    ret = ''
+    for char in data:
+        val = ord(char) ^ ((key & 0xffff) >> 8)
+        ret += '{:02X}'.format(val)
+        key = ((val + key) * CRYPT_CONST_1) + CRYPT_CONST_2
+    return ret
+
+
+def run(size, rng):
+    number = max(1, 65536 // size)
+    data = ''.join(chr(rng.randrange(256)) for _ in range(size))
+    encrypted = fanta_encrypt(data)
+    assert encrypted == legacy_encrypt(data)
+    assert fanta_decrypt(encrypted) == legacy_decrypt(encrypted)
+    for name, legacy, func, arg in (
+            ('decrypt', legacy_decrypt, fanta_decrypt, encrypted),
+            ('encrypt', legacy_encrypt, fanta_encrypt, data)):
+        old = timeit.timeit(lambda: legacy(arg), number=number) / number
+        new = timeit.timeit(lambda: func(arg), number=number) / number
+        print(f'{name} {size:>6} bytes: {old * 1e6:10.1f} us -> '
+              f'{new * 1e6:8.1f} us ({old / new:.1f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[16, 256, 4096, 65536])
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    for size in args.sizes:
+        run(size, rng)
+
+
+if __name__ == '__main__':
+    main()
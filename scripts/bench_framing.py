@@ -0,0 +1,80 @@
+"""
+Compares the incremental packet framer against the old string-based
+parser on pipelined IC/OOC traffic.
+
+Run from the root of the repository:
+    python scripts/bench_framing.py [--packets N] [--chunk BYTES]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from server.network.framing import FrameBuffer  # noqa: E402
+
+
+MS_PACKET = ('MS#chat#-#Phoenix#normal#Hold it! That testimony contradicts '
+             'the evidence!#def#0#0#7#0#0#0#0#0#0#Nick#-1#0#0#0#0#0#0#0##-#-#0#0##%')
+CT_PACKET = 'CT#Someone#Does anybody want to start a case?#%'
+
+
+class LegacyParser:
+    """The parser AOProtocol used before FrameBuffer."""
+
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, data):
+        self.buffer += data.decode('utf-8', 'ignore')
+        self.buffer = self.buffer.translate({ord(c): None for c in '\0'})
+
+    def frames(self):
+        while '#%' in self.buffer:
+            spl = self.buffer.split('#%', 1)
+            self.buffer = spl[1]
+            yield spl[0]
+
+
+def make_stream(packets):
+    stream = ''.join(MS_PACKET if i % 2 == 0 else CT_PACKET
+                     for i in range(packets))
+    return stream.encode('utf-8')
+
+
+def run(parser_cls, stream, chunk):
+    parser = parser_cls()
+    count = 0
+    for i in range(0, len(stream), chunk):
+        parser.feed(stream[i:i + chunk])
+        for _ in parser.frames():
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--packets', type=int, default=2000,
+                        help='number of pipelined packets per run')
+    parser.add_argument('--chunk', type=int, default=65536,
+                        help='size of each simulated network read')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    stream = make_stream(args.packets)
+    assert run(LegacyParser, stream, args.chunk) == \
+        run(FrameBuffer, stream, args.chunk) == args.packets
+
+    print(f'{args.packets} packets, {len(stream)} bytes, '
+          f'{args.chunk} bytes per read')
+    for name, cls in (('legacy str parser', LegacyParser),
+                      ('FrameBuffer', FrameBuffer)):
+        best = min(timeit.repeat(lambda: run(cls, stream, args.chunk),
+                                 number=1, repeat=args.repeat))
+        print(f'{name:>20}: {best * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares the compiled IP range matcher against the old linear scan of
+iprange_ban.txt.
+
+Run from the root of the repository:
+    python scripts/bench_ipranges.py [--rules N] [--lookups N]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from server.ipranges import IPRangeMatcher  # noqa: E402
+
+
+def make_rules(count, rng):
+    """Generate a mix of CIDR ranges, octet prefixes, IPv6 ranges and ASNs."""
+    rules = []
+    for _ in range(count):
+        kind = rng.randrange(10)
+        octets = [str(rng.randrange(1, 224)) for _ in range(4)]
+        if kind < 4:
+            length = rng.choice((16, 20, 24, 28, 32))
+            rules.append(f'{".".join(octets)}/{length}')
+        elif kind < 7:
+            rules.append('.'.join(octets[:rng.randrange(2, 4)]) + '.')
+        elif kind < 9:
+            rules.append(f'2001:db8:{rng.randrange(65536):x}::/48')
+        else:
+            rules.append(str(rng.randrange(1, 400000)))
+    return rules
+
+
+def legacy_match(rules, peername, asn):
+    """The loop TsuServer3.new_client used before IPRangeMatcher."""
+    for line, rangeBan in enumerate(rules):
+        if rangeBan != "" and peername.startswith(rangeBan) or asn == rangeBan:
+            return line
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rules', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--legacy-lookups', type=int, default=200,
+                        help='the linear scan is slow, so it gets fewer lookups')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rules = make_rules(args.rules, rng)
+    addresses = [('.'.join(str(rng.randrange(1, 224)) for _ in range(4)),
+                  str(rng.randrange(1, 400000)))
+                 for _ in range(args.lookups)]
+
+    start = timeit.default_timer()
+    matcher = IPRangeMatcher.from_lines(rules)
+    build = timeit.default_timer() - start
+    print(f'{args.rules} rules compiled in {build * 1000:.0f} ms')
+
+    compiled = min(timeit.repeat(
+        lambda: [matcher.match(ip, asn) for ip, asn in addresses],
+        number=1, repeat=3)) / len(addresses)
+    legacy_sample = addresses[:args.legacy_lookups]
+    legacy = min(timeit.repeat(
+        lambda: [legacy_match(rules, ip, asn) for ip, asn in legacy_sample],
+        number=1, repeat=3)) / len(legacy_sample)
+
+    print(f'{"linear scan":>16}: {legacy * 1e6:10.1f} us per connection')
+    print(f'{"IPRangeMatcher":>16}: {compiled * 1e6:10.1f} us per connection '
+          f'({legacy / compiled:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
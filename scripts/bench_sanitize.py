@@ -0,0 +1,94 @@
+"""
+Compares server.sanitize against the checks AOProtocol used to run on
+every IC and OOC message, on ordinary and adversarial (zalgo) text.
+
+Run from the root of the repository:
+    python scripts/bench_sanitize.py [--messages N] [--tolerance N]
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+import unicodedata
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from server import sanitize  # noqa: E402
+
+
+def legacy_dezalgo(text, tolerance):
+    """AOProtocol.dezalgo before server.sanitize."""
+    return re.sub('([̀-ͯ᪰-᫿᷀-᷿⃐-⃿︠-︯' +
+                  'ᅟᅠㅤ]' +
+                  '{' +
+                  re.escape(str(tolerance)) + ',})',
+                  '', text)
+
+
+def legacy_is_spammy(text):
+    return len(re.sub(r'[{}\\`|(~~)]', '', text).replace(
+        ' ', '')) < 3 and not text.startswith('<') and not text.startswith('>')
+
+
+def legacy_has_format_characters(text):
+    for c in text:
+        if unicodedata.category(c) == 'Cf':
+            return True
+    return False
+
+
+def make_messages(count, rng, zalgo):
+    marks = [chr(c) for c in range(0x300, 0x370)]
+    messages = []
+    for _ in range(count):
+        words = []
+        for _ in range(rng.randrange(5, 40)):
+            word = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz')
+                           for _ in range(rng.randrange(1, 9)))
+            if zalgo:
+                word = ''.join(c + ''.join(rng.choice(marks) for _ in
+                                           range(rng.randrange(0, 12)))
+                               for c in word)
+            words.append(word)
+        messages.append(' '.join(words)[:256])
+    return messages
+
+
+def run(label, messages, tolerance):
+    def legacy():
+        for text in messages:
+            legacy_is_spammy(text)
+            legacy_dezalgo(text, tolerance)
+            legacy_has_format_characters(text[:30])
+
+    def compiled():
+        for text in messages:
+            sanitize.is_spammy(text)
+            sanitize.dezalgo(text, tolerance)
+            sanitize.has_format_characters(text[:30])
+
+    for text in messages:
+        assert sanitize.dezalgo(text, tolerance) == \
+            legacy_dezalgo(text, tolerance)
+    old = min(timeit.repeat(legacy, number=1, repeat=5)) / len(messages)
+    new = min(timeit.repeat(compiled, number=1, repeat=5)) / len(messages)
+    print(f'{label:>10}: {old * 1e6:8.2f} us -> {new * 1e6:8.2f} us '
+          f'per message ({old / new:.1f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--tolerance', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    run('plain', make_messages(args.messages, rng, False), args.tolerance)
+    run('zalgo', make_messages(args.messages, rng, True), args.tolerance)
+
+
+if __name__ == '__main__':
+    main()
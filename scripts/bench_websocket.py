@@ -0,0 +1,81 @@
+"""
+Drives N WebSocket clients against a running server, and measures
+how long the handshake takes and the round-trip time of keepalives.
+
+Start a server with use_websockets enabled, then run from the root of
+the repository:
+    python scripts/bench_websocket.py [--url ws://127.0.0.1:50001]
+                                      [--clients N] [--pings N]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import websockets
+
+HANDSHAKE = ['HI#bench-{}#%', 'ID#AO2#2.9.0#%', 'askchaa#%', 'RC#%', 'RM#%',
+             'RD#%']
+
+
+async def receive_until(ws, header):
+    """Read messages until a packet starting with `header` arrives."""
+    while True:
+        message = await ws.recv()
+        for packet in message.split('#%'):
+            if packet.split('#', 1)[0] == header:
+                return
+
+
+async def run_client(url, index, pings, handshakes, rtts):
+    async with websockets.connect(url, max_size=None) as ws:
+        start = time.perf_counter()
+        for packet in HANDSHAKE:
+            await ws.send(packet.format(index))
+        await receive_until(ws, 'DONE')
+        handshakes.append(time.perf_counter() - start)
+
+        for _ in range(pings):
+            start = time.perf_counter()
+            await ws.send('CH#%')
+            await receive_until(ws, 'CHECK')
+            rtts.append(time.perf_counter() - start)
+            # Stay within the default rate limit
+            await asyncio.sleep(0.1)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='ws://127.0.0.1:50001')
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--pings', type=int, default=20)
+    args = parser.parse_args()
+
+    handshakes = []
+    rtts = []
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[run_client(args.url, i, args.pings, handshakes, rtts)
+          for i in range(args.clients)],
+        return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = [r for r in results if isinstance(r, Exception)]
+
+    print(f'{args.clients} clients, {len(errors)} failed, '
+          f'{elapsed:.1f} s in total')
+    for name, values in (('handshake', handshakes), ('keepalive', rtts)):
+        if values:
+            print(f'{name:>10}: median {statistics.median(values) * 1000:.1f} ms, '
+                  f'p99 {percentile(values, 0.99) * 1000:.1f} ms')
+    if errors:
+        print(f'first error: {errors[0]!r}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
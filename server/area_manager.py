@@ -28,7 +28,7 @@ from typing import List
 from server import database
 from server.exceptions import AreaError
 from server.evidence import EvidenceList
-from server.client_manager import ClientManager
+from server.client_manager import ClientManager, encode_command
 
 
 class AreaManager:
@@ -171,7 +171,9 @@ class AreaManager:
             if len(self.clients) == 0:
                 self.change_status('IDLE')
                 self.unlock()
-                client.area.owners = []
+                if len(self.owners) > 0:
+                    self.owners = []
+                    self.server.area_manager.send_arup_cms()
             if client.char_id != -1:
                 database.log_room('area.leave', client, self)
 
@@ -237,8 +239,7 @@ class AreaManager:
                 cmd (str): Command to send
             """
 
-            for c in self.clients:
-                c.send_command(cmd, *args)
+            self.server.client_manager.send_command_to(self.clients, cmd, *args)
 
         def send_owner_command(self, cmd: str, *args):
             """Send an AO-compatible command to all owners of the area
@@ -246,9 +247,8 @@ class AreaManager:
             Args:
                 cmd (str): Command to send
             """
-            for c in self.owners:
-                if c not in self.clients:
-                    c.send_command(cmd, *args)
+            self.server.client_manager.send_command_to(
+                [c for c in self.owners if c not in self.clients], cmd, *args)
 
         def broadcast_ooc(self, msg: str):
             """Broadcast an OOC message to all clients in the area.
@@ -811,6 +811,9 @@ class AreaManager:
                 self.chance = 1
                 self.showname = showname
 
+    # ARUP changes made within this many seconds are sent together
+    ARUP_DELAY = 0.1
+
     def __init__(self, server):
         self.server = server
         self.cur_id = 0
@@ -818,6 +821,13 @@ class AreaManager:
         self.load_areas()
         self.timer = AreaManager.Timer()
 
+        # Encoded ARUP packets by type, until something changes
+        self.arup_payloads = {}
+        # Last ARUP packets broadcasted by type
+        self.arup_sent = {}
+        self.arup_dirty = set()
+        self.arup_flush = None
+
     def load_areas(self):
         """Create all areas from a YAML file."""
         with open('config/areas.yaml', 'r') as chars:
@@ -849,6 +859,22 @@ class AreaManager:
                           item['shouts_allowed'], item['jukebox'],
                           item['abbreviation'], item['noninterrupting_pres']))
             self.cur_id += 1
+        self.build_indexes()
+        self.server.invalidate_command_cache()
+
+    def build_indexes(self):
+        """Index the areas by ID, name and abbreviation.
+        If several areas share a name or abbreviation, the first one wins.
+        """
+        self.areas_by_id = {}
+        self.areas_by_name = {}
+        self.areas_by_name_lower = {}
+        self.areas_by_abbreviation = {}
+        for area in self.areas:
+            self.areas_by_id.setdefault(area.id, area)
+            self.areas_by_name.setdefault(area.name, area)
+            self.areas_by_name_lower.setdefault(area.name.lower(), area)
+            self.areas_by_abbreviation.setdefault(area.abbreviation, area)
 
     def default_area(self):
         """Get the default area."""
@@ -864,10 +890,25 @@ class AreaManager:
             Area: The Area
         """
 
-        for area in self.areas:
-            if area.name == name:
-                return area
-        raise AreaError('Area not found.')
+        try:
+            return self.areas_by_name[name]
+        except KeyError:
+            raise AreaError('Area not found.')
+
+    def get_area_by_abbreviation(self, abbreviation: str) -> Area:
+        """Get an area by abbreviation.
+        Args:
+            abbreviation (str): Abbreviation of the area you are looking for
+        Raises:
+            AreaError: Area abbreviation not found
+        Returns:
+            Area: The Area
+        """
+
+        try:
+            return self.areas_by_abbreviation[abbreviation]
+        except KeyError:
+            raise AreaError('Area not found.')
 
     def get_area_by_id(self, area_id: int) -> Area:
         """Get an area by ID
@@ -879,10 +920,10 @@ class AreaManager:
             Area: The Area
         """
 
-        for area in self.areas:
-            if area.id == area_id:
-                return area
-        raise AreaError('Area ID not found.')
+        try:
+            return self.areas_by_id[area_id]
+        except (KeyError, TypeError):
+            raise AreaError('Area ID not found.')
 
     def abbreviate(self, name: str) -> str:
         """Abbreviate the name of a room.
@@ -912,41 +953,82 @@ class AreaManager:
         """
 
         for a_id in area_ids:
-            self.get_area_by_id(a_id).send_command(cmd, *args)
-            self.get_area_by_id(a_id).send_owner_command(cmd, *args)
+            area = self.get_area_by_id(a_id)
+            area.send_command(cmd, *args)
+            area.send_owner_command(cmd, *args)
 
     def send_arup_players(self):
         """Broadcast ARUP packet containing player counts."""
-        players_list = [0]
-        for area in self.areas:
-            playercount = -1
-            playercount = len([c for c in area.clients if not c.hidden])
-            players_list.append(playercount)
-        self.server.send_arup(players_list)
+        self.mark_arup_dirty(0)
 
     def send_arup_status(self):
         """Broadcast ARUP packet containing area statuses."""
-        status_list = [1]
-        for area in self.areas:
-            status_list.append(area.status)
-        self.server.send_arup(status_list)
+        self.mark_arup_dirty(1)
 
     def send_arup_cms(self):
         """Broadcast ARUP packet containing area CMs."""
-        cms_list = [2]
-        for area in self.areas:
-            cm = 'FREE'
-            if len(area.owners) > 0:
-                cm = area.get_cms()
-            cms_list.append(cm)
-        self.server.send_arup(cms_list)
+        self.mark_arup_dirty(2)
 
     def send_arup_lock(self):
         """Broadcast ARUP packet containing the lock status of each area."""
-        lock_list = [3]
-        for area in self.areas:
-            lock_list.append(area.is_locked.name)
-        self.server.send_arup(lock_list)
+        self.mark_arup_dirty(3)
+
+    def get_arup_args(self, arup_type: int) -> list:
+        """Build the arguments of an ARUP packet.
+        Args:
+            arup_type (int): 0 for player counts, 1 for statuses,
+            2 for CMs and 3 for lock statuses
+        Returns:
+            list: the arguments of the packet
+        """
+        if arup_type == 0:
+            return [0] + [len([c for c in area.clients if not c.hidden])
+                          for area in self.areas]
+        if arup_type == 1:
+            return [1] + [area.status for area in self.areas]
+        if arup_type == 2:
+            return [2] + [area.get_cms() if len(area.owners) > 0 else 'FREE'
+                          for area in self.areas]
+        return [3] + [area.is_locked.name for area in self.areas]
+
+    def get_arup_payload(self, arup_type: int) -> bytes:
+        """Get the encoded ARUP packet of a type, building it if the
+        areas changed since it was last built.
+        """
+        payload = self.arup_payloads.get(arup_type)
+        if payload is None:
+            payload = self.arup_payloads[arup_type] = encode_command(
+                'ARUP', *self.get_arup_args(arup_type))
+        return payload
+
+    def mark_arup_dirty(self, arup_type: int):
+        """Schedule an ARUP update for everyone. All the changes made
+        within `ARUP_DELAY` seconds are sent as a single packet per type.
+        """
+        self.arup_payloads.pop(arup_type, None)
+        self.arup_dirty.add(arup_type)
+        if self.arup_flush is None:
+            self.arup_flush = asyncio.get_event_loop().call_later(
+                self.ARUP_DELAY, self.flush_arup)
+
+    def flush_arup(self):
+        """Broadcast the ARUP packets that changed since the last flush."""
+        self.arup_flush = None
+        dirty, self.arup_dirty = self.arup_dirty, set()
+        for arup_type in sorted(dirty):
+            payload = self.get_arup_payload(arup_type)
+            if payload == self.arup_sent.get(arup_type):
+                continue
+            self.arup_sent[arup_type] = payload
+            # Clients still in the handshake get every type in send_done
+            for c in self.server.client_manager.clients:
+                if c.is_checked:
+                    c.send_bytes(payload)
+
+    def send_arup_to(self, client):
+        """Send the current state of all areas to a single client."""
+        for arup_type in range(4):
+            client.send_bytes(self.get_arup_payload(arup_type))
 
     def mods_online(self):
         num = 0
@@ -19,6 +19,7 @@ import re
 import time
 import string
 import asyncio
+import logging
 
 import arrow
 
@@ -29,6 +30,25 @@ from server import database
 from server.constants import TargetType
 from server.exceptions import ClientError, AreaError
 
+logger = logging.getLogger('debug')
+
+
+def encode_command(command: str, *args) -> bytes:
+    """Compose an AO-compatible message, with arguments delimited by `#`
+    and ending with `#%`.
+
+    Args:
+        command (str): command name
+        *args: tuple containing the packet arguments
+
+    Returns:
+        bytes: the UTF-8 encoded packet
+    """
+    if args:
+        return f'{command}#{"#".join([str(x) for x in args])}#%'.encode('utf-8')
+    return f'{command}#%'.encode('utf-8')
+
+
 class ClientManager:
     """Holds the list of all clients currently connected to the server."""
     class Client:
@@ -69,7 +89,16 @@ class ClientManager:
             self.is_ooc_muted = False
             self.pm_mute = False
             self.mod_call_time = 0
+            # Not known until the handshake, see ClientManager.set_ipid
             self.ipid = ipid
+            self.address = transport.get_extra_info('peername')[0]
+
+            # Outbound packets produced during one event loop tick,
+            # merged into a single write
+            self.outbound = []
+            self.outbound_size = 0
+            self.outbound_flush = None
+            self.write_paused = False
 
             # Pairing stuff
             self.charid_pair = -1
@@ -105,7 +134,6 @@ class ClientManager:
                                ['times_per_interval'])
             ]
             # security stuff
-            self.clientscon = 0
             self.gm_save_time = 0
 
             # movement system stuff
@@ -128,7 +156,54 @@ class ClientManager:
             Args:
                 msg (str): Message to send
             """
-            self.transport.write(msg.encode('utf-8'))
+            self.send_bytes(msg.encode('utf-8'))
+
+        def send_bytes(self, data: bytes):
+            """Send an already encoded packet over TCP.
+
+            The packet is queued and written along with everything else
+            sent during the current event loop tick. A client that falls
+            too far behind while its transport is paused is dropped.
+
+            Args:
+                data (bytes): Encoded packet to send
+            """
+            self.outbound.append(data)
+            self.outbound_size += len(data)
+            if self.write_paused:
+                if self.outbound_size > self.server.config['outbound_buffer']['max_backlog']:
+                    logger.debug(
+                        f'{self.ipid} fell too far behind ({self.outbound_size} bytes queued), dropping.')
+                    self.outbound.clear()
+                    self.outbound_size = 0
+                    self.abort()
+                return
+            if self.outbound_flush is None:
+                self.outbound_flush = asyncio.get_event_loop().call_soon(
+                    self.flush_outbound)
+
+        def flush_outbound(self):
+            """Write all queued packets to the transport at once."""
+            if self.outbound_flush is not None:
+                self.outbound_flush.cancel()
+                self.outbound_flush = None
+            if self.write_paused or not self.outbound:
+                return
+            data = b''.join(self.outbound)
+            self.outbound.clear()
+            self.outbound_size = 0
+            self.transport.write(data)
+
+        def pause_writing(self):
+            """Stop writing to the transport until its buffer drains.
+            Packets are queued in the meantime.
+            """
+            self.write_paused = True
+
+        def resume_writing(self):
+            """Resume writing to the transport and send any queued packets."""
+            self.write_paused = False
+            self.flush_outbound()
 
         def send_command(self, command: str, *args):
             """Compose and send an AO-compatible message, with arguments
@@ -138,31 +213,63 @@ class ClientManager:
                 command (str): command name
                 *args: tuple containing the packet arguments
             """
-            if args:
-                if command == 'MS':
-                    if self.blinded and args[0] != 'broadcast':
-                        return #Don't receive any chat messages when blinded that are not broadcast_ic'ed
-                    if args[0] == 'broadcast':
-                        args[0] = '0'
-                    for evi_num in range(len(self.evi_list)):
-                        if self.evi_list[evi_num] == args[11]:
-                            lst = list(args) # convert to a list so we can modify it
-                            lst[11] = evi_num
-                            args = tuple(lst) # then convert back to a tuple when finished
-                            break
-                        # <2.9 can't parse Y offset so we strip it out based on version
-                        if self.release == '2' and self.major_version in ['8', '7', '6']:
-                            lst = list(args) 
-                            offset_pair_list = lst[19].split('<and>') # MS arg 19 is self offset
-                            lst[19] = offset_pair_list[0]
-                            other_offset_list = lst[20].split('<and>') # MS arg 20 is paired offset
-                            lst[20] = other_offset_list[0]
-                            args = tuple(lst)
-                            
-                self.send_raw_message(
-                    f'{command}#{"#".join([str(x) for x in args])}#%')
-            else:
-                self.send_raw_message(f'{command}#%')
+            variant = self.get_command_variant(command, args)
+            if variant is None:
+                return
+            self.send_bytes(encode_command(
+                command, *self.apply_command_variant(args, variant)))
+
+        def get_command_variant(self, command: str, args: tuple):
+            """Get the version of a packet that this client should receive.
+
+            Most packets are the same for everyone, but IC messages depend
+            on whether the client is blinded, on its evidence list and on
+            its version, so that they can be encoded once per variant
+            when broadcasted.
+
+            Args:
+                command (str): command name
+                args (tuple): the packet arguments
+
+            Returns:
+                A hashable key describing the variant, or None if the client
+                should not receive the packet at all
+            """
+            if command != 'MS' or not args:
+                return ()
+            if self.blinded and args[0] != 'broadcast':
+                return None #Don't receive any chat messages when blinded that are not broadcast_ic'ed
+            try:
+                evidence = self.evi_list.index(args[11])
+            except ValueError:
+                evidence = args[11]
+            # <2.9 can't parse Y offset so we strip it out based on version
+            strip_offsets = self.release == '2' and self.major_version in ['8', '7', '6']
+            return evidence, strip_offsets
+
+        @staticmethod
+        def apply_command_variant(args: tuple, variant: tuple) -> tuple:
+            """Build the arguments of a packet for a variant returned by
+            `get_command_variant`.
+
+            Args:
+                args (tuple): the packet arguments
+                variant (tuple): variant key
+
+            Returns:
+                tuple: the packet arguments for that variant
+            """
+            if not variant:
+                return args
+            evidence, strip_offsets = variant
+            lst = list(args) # convert to a list so we can modify it
+            if lst[0] == 'broadcast':
+                lst[0] = '0'
+            lst[11] = evidence
+            if strip_offsets:
+                lst[19] = lst[19].split('<and>')[0] # MS arg 19 is self offset
+                lst[20] = lst[20].split('<and>')[0] # MS arg 20 is paired offset
+            return tuple(lst)
 
         def send_ooc(self, msg: str):
             """Send an out-of-character message to the client.
@@ -222,8 +329,16 @@ class ClientManager:
 
         def disconnect(self):
             """Disconnect the client gracefully."""
+            self.flush_outbound()
             self.transport.close()
 
+        def abort(self):
+            """Disconnect the client immediately, discarding any unsent data."""
+            if self.outbound_flush is not None:
+                self.outbound_flush.cancel()
+                self.outbound_flush = None
+            self.transport.abort()
+
         def change_character(self, char_id: int, force=False):
             """Change the client's character or force the character selection
             screen to appear for the client.
@@ -252,7 +367,7 @@ class ClientManager:
                     else:
                         raise ClientError('Character not available.')
             old_char = self.char_name
-            self.char_id = char_id
+            self.server.client_manager.set_char_id(self, char_id)
             self.pos = ''
             self.area.shadow_status[self.char_id] = [self.ipid]
             self.send_command('PV', self.id, 'CID', self.char_id)
@@ -262,6 +377,9 @@ class ClientManager:
             new_char = self.char_name
             database.log_room('char.change', self, self.area,
                               message={'from': old_char, 'to': new_char})
+            if any(self in area.owners for area in self.server.area_manager.areas):
+                # CMs are listed with their character names
+                self.server.area_manager.send_arup_cms()
 
         def change_music_cd(self) -> int:
             """Check if the client can change music or not.
@@ -582,16 +700,13 @@ class ClientManager:
             self.send_command('LE', *self.area.get_evidence_list(self))
             self.send_command('MM', 1)
 
-            self.server.area_manager.send_arup_players()
-            self.server.area_manager.send_arup_status()
-            self.server.area_manager.send_arup_cms()
-            self.server.area_manager.send_arup_lock()
+            self.server.area_manager.send_arup_to(self)
 
             self.send_command('DONE')
 
         def char_select(self):
             """Force the client to select a different character."""
-            self.char_id = -1
+            self.server.client_manager.set_char_id(self, -1)
             self.send_done()
 
         def get_available_char_list(self):
@@ -699,16 +814,38 @@ class ClientManager:
 
     def __init__(self, server):
         self.clients = set()
+        # {ipid: {client}} and {hdid: {client}}, kept up to date by
+        # set_ipid, set_hdid and remove_client
+        self.clients_by_ipid = {}
+        self.clients_by_hdid = {}
+        # Indexes for get_targets: {id: client}, {char_id: {client}} and
+        # {lowercase OOC name: {client}}, kept up to date by new_client,
+        # set_char_id, set_name and remove_client
+        self.clients_by_id = {}
+        self.clients_by_char_id = {}
+        self.clients_by_name = {}
+        # {lowercase character name: [char_id]}, for the current char_list
+        self.char_ids_by_name = {}
+        self.char_ids_source = None
         self.server = server
         self.cur_id = [i for i in range(self.server.config['playerlimit'])]
 
     def new_client_preauth(self, client: Client) -> bool:
+        """Check whether a client is within the multiclient limit."""
         maxclients = self.server.config['multiclient_limit']
-        for c in self.server.client_manager.clients:
-            if c.ipid == client.ipid:
-                if c.clientscon > maxclients:
-                    return False
-        return True
+        return len(self.clients_by_ipid.get(client.ipid, ())) <= maxclients
+
+    @staticmethod
+    def _index(index: dict, key, client: Client):
+        index.setdefault(key, set()).add(client)
+
+    @staticmethod
+    def _unindex(index: dict, key, client: Client):
+        clients = index.get(key)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del index[key]
 
     def new_client(self, transport: asyncio.Transport) -> Client:
         """Create a new client, add it to the list, and assign it a player ID.
@@ -728,24 +865,70 @@ class ClientManager:
             transport.write(b'BD#This server is full.#%')
             raise ClientError
 
-        peername = transport.get_extra_info('peername')[0]
-
-        c = self.Client(
-            self.server, transport, user_id,
-            database.ipid(peername))
+        c = self.Client(self.server, transport, user_id, None)
         self.clients.add(c)
-        temp_ipid = c.ipid
-        for client in self.server.client_manager.clients:
-            if client.ipid == temp_ipid:
-                client.clientscon += 1
+        self.clients_by_id[c.id] = c
+        self._index(self.clients_by_hdid, c.hdid, c)
+        self._index(self.clients_by_char_id, c.char_id, c)
+        self._index(self.clients_by_name, c.name.lower(), c)
         return c
 
+    def set_ipid(self, client: Client, ipid: int):
+        """Set the IPID of a client once it has been looked up, and count
+        it towards the multiclient limit.
+
+        Args:
+            client (Client): client going through the handshake
+            ipid (int): IPID of the client's address
+        """
+        if client.ipid is not None:
+            self._unindex(self.clients_by_ipid, client.ipid, client)
+        client.ipid = ipid
+        self._index(self.clients_by_ipid, ipid, client)
+
+    def set_hdid(self, client: Client, hdid: str):
+        """Set the HDID sent by a client in its handshake.
+
+        Args:
+            client (Client): client going through the handshake
+            hdid (str): HDID of the client
+        """
+        self._unindex(self.clients_by_hdid, client.hdid, client)
+        client.hdid = hdid
+        self._index(self.clients_by_hdid, hdid, client)
+
+    def set_char_id(self, client: Client, char_id: int):
+        """Set the character of a client.
+
+        Args:
+            client (Client): client changing character
+            char_id (int): ID of the character, or -1 for spectators
+        """
+        self._unindex(self.clients_by_char_id, client.char_id, client)
+        client.char_id = char_id
+        self._index(self.clients_by_char_id, char_id, client)
+
+    def set_name(self, client: Client, name: str):
+        """Set the OOC name of a client.
+
+        Args:
+            client (Client): client changing name
+            name (str): new OOC name
+        """
+        self._unindex(self.clients_by_name, client.name.lower(), client)
+        client.name = name
+        self._index(self.clients_by_name, name.lower(), client)
+
     def remove_client(self, client: Client):
         """Remove a disconnected client from the client list.
 
         Args:
             client (Client): Disconnected client
         """
+        if client.outbound_flush is not None:
+            client.outbound_flush.cancel()
+            client.outbound_flush = None
+        client.outbound.clear()
         if client.area.jukebox:
             client.area.remove_jukebox_vote(client, True)
         for a in self.server.area_manager.areas:
@@ -756,17 +939,44 @@ class ClientManager:
                     if a.is_locked != a.Locked.FREE:
                         a.unlock()
         heappush(self.cur_id, client.id)
-        temp_ipid = client.ipid
-        for c in self.server.client_manager.clients:
-            if c.ipid == temp_ipid:
-                c.clientscon -= 1
+        if client.ipid is not None:
+            self._unindex(self.clients_by_ipid, client.ipid, client)
+        self._unindex(self.clients_by_hdid, client.hdid, client)
+        self.clients_by_id.pop(client.id, None)
+        self._unindex(self.clients_by_char_id, client.char_id, client)
+        self._unindex(self.clients_by_name, client.name.lower(), client)
         self.clients.remove(client)
 
+    def send_command_to(self, clients, command: str, *args):
+        """Broadcast an AO-compatible command to a group of clients.
+
+        The packet is only encoded once for every variant of it that the
+        clients need (see `Client.get_command_variant`).
+
+        Args:
+            clients (Iterable[Client]): recipients
+            command (str): command name
+            *args: tuple containing the packet arguments
+        """
+        packets = {}
+        for c in clients:
+            variant = c.get_command_variant(command, args)
+            if variant is None:
+                continue
+            packet = packets.get(variant)
+            if packet is None:
+                packet = packets[variant] = encode_command(
+                    command, *c.apply_command_variant(args, variant))
+            c.send_bytes(packet)
+
     def get_targets(self, client: Client, key: TargetType, value: Any, local=False, single=False) -> List[Client]:
         """Find players by a combination of identifying data.
             Possible keys: player ID, OOC name, character name, HDID, IPID,
             IP address (same as IPID)
 
+            Names match when they are a prefix of the value (ignoring
+            case), so that the rest of the value can be a message.
+
         Args:
             client (Client): [description]
             key (TargetType): The type of identifier that the value parameter represents
@@ -777,40 +987,67 @@ class ClientManager:
         Returns:
             List[Client]: A list containing the targeted clients
         """
-
-        areas = None
-        if local:
-            areas = [client.area]
-        else:
-            areas = client.server.area_manager.areas
-        targets = []
         if key == TargetType.ALL:
-            for nkey in range(6):
-                targets += self.get_targets(client, nkey, value, local)
-        for area in areas:
-            for client in area.clients:
-                if key == TargetType.IP:
-                    if value.lower().startswith(client.ip.lower()):
-                        targets.append(client)
-                elif key == TargetType.OOC_NAME:
-                    if value.lower().startswith(
-                            client.name.lower()) and client.name:
-                        targets.append(client)
-                elif key == TargetType.CHAR_NAME:
-                    if value.lower().startswith(
-                            client.char_name.lower()):
-                        targets.append(client)
-                elif key == TargetType.ID:
-                    if client.id == value:
-                        targets.append(client)
-                elif key == TargetType.IPID:
-                    if client.ipid == value:
-                        targets.append(client)
-                elif key == TargetType.AFK:
-                    if client in area.afkers:
-                        targets.append(client)
+            keys = (TargetType.ID, TargetType.OOC_NAME, TargetType.CHAR_NAME,
+                    TargetType.IPID, TargetType.HDID)
+        else:
+            keys = (key,)
+
+        candidates = set()
+        for key in keys:
+            candidates |= self._find_candidates(client, key, value)
+
+        # Clients that have not finished the handshake are in no area
+        targets = [c for c in candidates if c in c.area.clients and
+                   (not local or c.area is client.area)]
+        targets.sort(key=lambda c: (c.area.id, c.id))
         return targets
 
+    def _find_candidates(self, client: Client, key: TargetType, value: Any) -> set:
+        if key == TargetType.ID:
+            target = self.clients_by_id.get(value)
+            return {target} if target is not None else set()
+        if key in (TargetType.IPID, TargetType.IP):
+            return set(self.clients_by_ipid.get(value, ()))
+        if key == TargetType.HDID:
+            return set(self.clients_by_hdid.get(value, ()))
+        if key == TargetType.OOC_NAME:
+            found = set()
+            for prefix in self._prefixes(value):
+                if prefix != '':
+                    found |= self.clients_by_name.get(prefix, set())
+            return found
+        if key == TargetType.CHAR_NAME:
+            found = set()
+            char_ids_by_name = self._char_ids_by_name()
+            for prefix in self._prefixes(value):
+                for char_id in char_ids_by_name.get(prefix, ()):
+                    found |= self.clients_by_char_id.get(char_id, set())
+            return found
+        if key == TargetType.AFK:
+            return {c for area in self.server.area_manager.areas
+                    for c in area.afkers}
+        return set()
+
+    @staticmethod
+    def _prefixes(value):
+        """Get every prefix of a value, lowercased, longest first."""
+        if not isinstance(value, str):
+            return []
+        value = value.lower()
+        return [value[:i] for i in range(len(value), -1, -1)]
+
+    def _char_ids_by_name(self) -> dict:
+        """Get the character IDs by lowercase name, rebuilt whenever the
+        character list is reloaded."""
+        char_list = self.server.char_list
+        if self.char_ids_source is not char_list:
+            self.char_ids_by_name = {'spectator': [-1]}
+            for char_id, name in enumerate(char_list):
+                self.char_ids_by_name.setdefault(name.lower(), []).append(char_id)
+            self.char_ids_source = char_list
+        return self.char_ids_by_name
+
     def get_muted_clients(self):
         """Get a list of muted clients."""
         clients = []
@@ -852,5 +1089,7 @@ class ClientManager:
                 client.disconnect()
 
     def get_multiclients(self, ipid=-1, hdid=""):
-        return [c for c in self.clients if c.ipid == ipid or c.hdid == hdid]
+        """Get the clients that share an IPID or an HDID."""
+        return list(self.clients_by_ipid.get(ipid, set()) |
+                    self.clients_by_hdid.get(hdid, set()))
 				
@@ -91,6 +91,26 @@ def mod_only(area_owners=False):
     return decorator
 
 
+def run_async(client, coro):
+    """
+    Run the slow part of a command (such as a database query) as
+    a background task, reporting errors to the client the same way
+    they are reported for regular commands.
+    """
+    import asyncio, logging
+    from ..exceptions import ClientError, AreaError, ArgumentError, ServerError
+    async def wrapper():
+        try:
+            await coro
+        except (ClientError, AreaError, ArgumentError, ServerError) as ex:
+            client.send_ooc(ex)
+        except Exception:
+            client.send_ooc(
+                'An internal error occurred. Please check the server log.')
+            logging.getLogger('debug').exception('Exception while running a command')
+    return asyncio.ensure_future(wrapper())
+
+
 # Note that only the members of __all__ in each module will be imported.
 # There must be an __all__ in each module in order for reloading
 # to work properly.
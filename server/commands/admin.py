@@ -11,7 +11,7 @@ from pytimeparse import parse
 from server import database
 from server.constants import TargetType
 from server.exceptions import ClientError, ServerError, ArgumentError
-from . import mod_only, list_commands, list_submodules, help
+from . import mod_only, list_commands, list_submodules, help, run_async
 
 __all__ = [
     'ooc_cmd_motd',
@@ -212,12 +212,12 @@ def ooc_cmd_refresh(client, arg):
     if len(arg) > 0:
         raise ClientError('This command does not take in any arguments!')
     else:
-        try:
-            client.server.refresh()
-            database.log_simple('Refresh', client)
-            client.send_ooc('You have reloaded the server.')
-        except ServerError:
-            raise
+        run_async(client, _refresh(client))
+
+async def _refresh(client):
+    await client.server.refresh_async()
+    database.log_simple('Refresh', client)
+    client.send_ooc('You have reloaded the server.')
 
 @mod_only()
 def ooc_cmd_restart(client, arg):
@@ -251,12 +251,13 @@ def ooc_cmd_whois(client, arg):
         ooc_match = c.name and arg.lower() in c.name.lower()
         if ipid_match or char_match or showname_match or ooc_match:
             found_clients.add(c)
+    run_async(client, _send_whois(client, arg, found_clients))
+
+async def _send_whois(client, arg, found_clients):
     info = f"WHOIS lookup for {arg}:"
     for c in found_clients:
-        recent_chars, most_used_chars = database.char_history(c.ipid)
-        last_shownames = database.recent_shownames(c.ipid)
-        last_ooc_names = database.recent_ooc_names(c.ipid)
-        last_hdids = database.hdid_history(c.ipid)
+        recent_chars, most_used_chars, last_shownames, last_ooc_names, last_hdids = \
+            await database.aio.player_history(c.ipid)
         info += f"\n ID: [{c.id}]"
         info += f" | Char ID: {c.char_id} | Char Name: {c.char_name}"
         if c.showname != "":
@@ -319,9 +320,12 @@ def ooc_cmd_lastchar(client, arg):
     except KeyError:
         client.send_ooc("Character hasn't been occupied in area since server start.")
         return
+    run_async(client, _send_lastchar(client, arg, ex_list))
+
+async def _send_lastchar(client, arg, ex_list):
     last_ipid = ex_list[0]
-    last_shownames = database.recent_shownames(last_ipid)
-    last_ooc_names = database.recent_ooc_names(last_ipid)
+    last_shownames = await database.aio.recent_shownames(last_ipid)
+    last_ooc_names = await database.aio.recent_ooc_names(last_ipid)
     info = f"lastchar lookup for {arg}:\n"
     info += f"IPID: {ex_list}\n"
     info += f"Last Known Shownames: {last_shownames}\n"
@@ -425,16 +429,20 @@ def ooc_cmd_unban(client, arg):
         raise ArgumentError('You must specify a target. Use /unban <ban_id...>')
     args = list(arg.split(' '))
     client.send_ooc(f'Attempting to lift {len(args)} ban(s)...')
-    for ban_id in args:
+    run_async(client, _unban(client, args))
+
+async def _unban(client, ban_ids):
+    for ban_id in ban_ids:
         ban_info = database.find_ban(ban_id=ban_id)
         if ban_info is not None:
             try:
                 special_ban_data = json.loads(ban_info.ban_data)
                 if special_ban_data['ban_type'] == 'area_curse':
-                    _area_uncurse(client, ban_info)
+                    ipids = await database.aio.run(lambda: ban_info.ipids)
+                    _area_uncurse(client, ban_info, ipids)
             except (KeyError, ValueError, TypeError):
                 pass
-            database.unban(ban_id=ban_id)
+            await database.aio.unban(ban_id=ban_id)
             client.send_ooc(f'Removed ban ID {ban_id}.')
             database.log_misc('unban', client, data={'id': ban_id})
         else:
@@ -447,10 +455,16 @@ def ooc_cmd_bans(client, _arg):
     Usage: /bans
     Alias: /bs
     """
+    run_async(client, _send_bans(client))
+
+async def _send_bans(client):
+    def recent_bans():
+        # banned_by_name runs a query as well
+        return [(ban, ban.banned_by_name) for ban in database.recent_bans()]
     msg = 'Last 5 bans:\n'
-    for ban in database.recent_bans():
+    for ban, banned_by_name in await database.aio.run(recent_bans):
         time = arrow.get(ban.ban_date).humanize()
-        msg += f'{time}: {ban.banned_by_name} ({ban.banned_by}) issued ban ' \
+        msg += f'{time}: {banned_by_name} ({ban.banned_by}) issued ban ' \
                f'{ban.ban_id} (\'{ban.reason}\')\n'
     client.send_ooc(msg)
 
@@ -471,11 +485,20 @@ def ooc_cmd_baninfo(client, arg):
         lookup_type = args[1]
     if lookup_type not in ('ban_id', 'ipid', 'hdid'):
         raise ArgumentError('Incorrect lookup type.')
-    bans = database.ban_history(**{lookup_type: args[0]})
+    run_async(client, _send_baninfo(client, lookup_type, args[0]))
+
+async def _send_baninfo(client, lookup_type, target):
+    # Formatting the message looks up the IPIDs, HDIDs and issuer
+    # of every ban, so it is all done on the database threads.
+    msg = await database.aio.run(_baninfo_message, lookup_type, target)
+    client.send_ooc(msg)
+
+def _baninfo_message(lookup_type, target):
+    bans = database.ban_history(**{lookup_type: target})
     if bans is None:
-        client.send_ooc('No ban found for this ID.')
+        return 'No ban found for this ID.'
     else:
-        msg = f'Bans for {lookup_type} {args[0]}:'
+        msg = f'Bans for {lookup_type} {target}:'
         for ban in bans:
             msg += f'\nBan ID: {ban.ban_id}\n'
             msg += 'Affected IPIDs: ' + \
@@ -491,7 +514,7 @@ def ooc_cmd_baninfo(client, arg):
                 msg += f'Unban date: {unban_date.format()} ({unban_date.humanize()})'
             else:
                 msg += 'Unban date: N/A'
-        client.send_ooc(msg)
+        return msg
 
 @mod_only()
 def ooc_cmd_mute(client, arg):
@@ -694,8 +717,10 @@ def ooc_cmd_area_curse(client, arg):
         client.send_ooc(f'{len(targets)} clients were area cursed.')
     client.send_ooc(f'{ipid} was area cursed. Ban ID: {ban_id}')
 
-def _area_uncurse(client, ban_info):
-    for ipid in ban_info.ipids:
+def _area_uncurse(client, ban_info, ipids=None):
+    if ipids is None:
+        ipids = ban_info.ipids
+    for ipid in ipids:
         targets = client.server.client_manager.get_targets(client, TargetType.IPID, ipid, False)
         for c in targets:
             database.log_misc('uncurse', c, data={'id': ban_info.ban_id})
@@ -740,7 +765,10 @@ def kickban(client, arg, ban_hdid):
         ipid = int(raw_ipid)
     except ValueError:
         raise ClientError(f"{raw_ipid} does not look like a valid IPID.")
-    ban_id = database.ban(
+    run_async(client, _kickban(client, ipid, reason, ban_id, unban_date, ban_hdid))
+
+async def _kickban(client, ipid, reason, ban_id, unban_date, ban_hdid):
+    ban_id = await database.aio.ban(
         ipid,
         reason,
         ban_type="ipid",
@@ -753,8 +781,8 @@ def kickban(client, arg, ban_hdid):
         if targets:
             for c in targets:
                 if ban_hdid:
-                    database.ban(c.hdid, reason,
-                                 ban_type="hdid", ban_id=ban_id)
+                    await database.aio.ban(c.hdid, reason,
+                                           ban_type="hdid", ban_id=ban_id)
                 c.send_command("KB", reason)
                 c.disconnect()
                 database.log_misc("ban", client, target=c,
@@ -273,15 +273,15 @@ def ooc_cmd_knock(client, arg):
     if client.blinded:
         raise ClientError("Failed to knock: you are blinded!")
     try:
-        area = None
-        for _area in client.server.area_manager.areas:
-            if (_area.name.lower() == arg.lower()
-                or _area.abbreviation == arg
-                or (arg.isdigit() and _area.id == int(arg))):
-                area = _area
-                break
-        if area is None:
+        area_manager = client.server.area_manager
+        matches = [a for a in (area_manager.areas_by_name_lower.get(arg.lower()),
+                               area_manager.areas_by_abbreviation.get(arg),
+                               area_manager.areas_by_id.get(int(arg)) if arg.isdigit() else None)
+                   if a is not None]
+        if not matches:
             raise ClientError("Area not found.")
+        # Same precedence as going through the area list
+        area = min(matches, key=lambda a: a.id)
         area.send_command("RT", "knock")
         if area == client.area:
             area.broadcast_ooc(f"💢 [{client.id}]:{client.char_name} ({client.showname}) knocks for attention. 💢")
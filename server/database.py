@@ -3,6 +3,11 @@ import os
 import asyncio
 import sqlite3
 import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import arrow
 
@@ -15,7 +20,6 @@ from datetime import datetime
 from functools import reduce
 from textwrap import dedent
 from typing import List
-from collections import Counter
 
 from .exceptions import ServerError
 
@@ -25,29 +29,297 @@ _database_singleton = None
 
 def __getattr__(name):
     global _database_singleton
+    # Keep introspection (imports, pytest, ...) from opening the database
+    if name.startswith('__'):
+        raise AttributeError(name)
     if _database_singleton is None:
         _database_singleton = Database()
     return getattr(_database_singleton, name)
 
 
+class EventWriter:
+    """
+    Writes log events to the database from a background thread, so that
+    disk latency never blocks the event loop.
+
+    Events are taken from a bounded queue and committed in batches of
+    up to `batch_rows` rows, or whatever arrived within `batch_interval`
+    seconds of the first one. Events are dropped (and counted) when
+    the queue is full.
+    """
+    _STOP = object()
+
+    def __init__(self, db_file, queue_size=10000, batch_rows=500,
+                 batch_interval=0.25):
+        self.db_file = db_file
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_rows = batch_rows
+        self.batch_interval = batch_interval
+        # Counted from both the event loop and the writer thread
+        self.counts_lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+        self.thread = None
+
+    @property
+    def depth(self):
+        """Number of events waiting to be written."""
+        return self.queue.qsize()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name='event-writer',
+                                       daemon=True)
+        self.thread.start()
+
+    def put(self, sql, params):
+        """Queue an event for writing."""
+        try:
+            self.queue.put_nowait((sql, params))
+        except queue.Full:
+            self._count(dropped=1)
+
+    def _count(self, written=0, dropped=0):
+        with self.counts_lock:
+            self.written += written
+            self.dropped += dropped
+
+    def flush(self):
+        """Block until every queued event has been written."""
+        self.queue.join()
+
+    def stop(self):
+        """Write all queued events and stop the writer thread."""
+        if not self.running:
+            return
+        self.queue.put(self._STOP)
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_file)
+        conn.execute('PRAGMA foreign_keys = ON')
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.batch_rows and batch[-1] is not self._STOP:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            if batch[-1] is self._STOP:
+                stopping = True
+                batch.pop()
+                self.queue.task_done()
+            self._write(conn, batch)
+            for _ in batch:
+                self.queue.task_done()
+        conn.close()
+
+    def _write(self, conn, batch):
+        written = 0
+        try:
+            with conn:
+                for sql, params in batch:
+                    try:
+                        conn.execute(sql, params)
+                    except sqlite3.IntegrityError as exc:
+                        logger.debug(f'Dropping log event: {exc}')
+                    else:
+                        written += 1
+        except sqlite3.Error as exc:
+            # The whole batch was rolled back
+            logger.error(f'Could not write {len(batch)} log events: {exc}')
+            self._count(dropped=len(batch))
+        else:
+            self._count(written=written, dropped=len(batch) - written)
+
+
+class AsyncDatabase:
+    """
+    Awaitable versions of the methods of a Database. The queries run on
+    a small dedicated thread pool, each thread with its own connection,
+    so that slow queries never block the event loop:
+
+        ban = await database.aio.find_ban(ipid, hdid)
+    """
+
+    def __init__(self, db, max_workers=4):
+        self.db = db
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='database')
+
+    def run(self, func, *args, **kwargs):
+        """Run any blocking function on the database threads."""
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self.executor,
+                                    partial(func, *args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self.db, name)
+        if not callable(method):
+            raise AttributeError(name)
+
+        def wrapper(*args, **kwargs):
+            return self.run(method, *args, **kwargs)
+        return wrapper
+
+
+class BanIndex:
+    """
+    In-memory copy of the active bans, so that checking whether
+    a player is banned is a dictionary lookup instead of a query.
+    It is loaded at startup and kept up to date by Database.ban and
+    Database.unban, which write through to the database.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bans = {}
+        self.by_ipid = {}
+        self.by_hdid = {}
+
+    def load(self, conn):
+        """Load all active bans from the database."""
+        bans = {row['ban_id']: Database.Ban(**row) for row in
+                conn.execute('SELECT * FROM bans WHERE unbanned = 0')}
+        by_ipid = {}
+        for row in conn.execute(dedent('''
+                SELECT ipid, ban_id FROM ip_bans
+                JOIN bans USING (ban_id) WHERE unbanned = 0
+                ''')):
+            by_ipid.setdefault(str(row['ipid']), set()).add(row['ban_id'])
+        by_hdid = {}
+        for row in conn.execute(dedent('''
+                SELECT hdid, ban_id FROM hdid_bans
+                JOIN bans USING (ban_id) WHERE unbanned = 0
+                ''')):
+            by_hdid.setdefault(row['hdid'], set()).add(row['ban_id'])
+        with self.lock:
+            self.bans, self.by_ipid, self.by_hdid = bans, by_ipid, by_hdid
+
+    def add(self, ban):
+        """Add a new ban."""
+        with self.lock:
+            self.bans[ban.ban_id] = ban
+
+    def add_target(self, ban_id, ipid=None, hdid=None):
+        """Add a target to an existing ban."""
+        with self.lock:
+            if ipid is not None:
+                self.by_ipid.setdefault(str(ipid), set()).add(ban_id)
+            if hdid is not None:
+                self.by_hdid.setdefault(hdid, set()).add(ban_id)
+
+    def remove(self, ban_id):
+        """Forget a ban that was lifted."""
+        with self.lock:
+            self.bans.pop(ban_id, None)
+            for index in (self.by_ipid, self.by_hdid):
+                for key in [key for key, ban_ids in index.items()
+                            if ban_id in ban_ids]:
+                    index[key].discard(ban_id)
+                    if not index[key]:
+                        del index[key]
+
+    def find(self, ipid=None, hdid=None, ban_id=None):
+        """Find an active ban on an IPID, an HDID or with a given ID."""
+        with self.lock:
+            ban_ids = set()
+            if ipid is not None:
+                ban_ids |= self.by_ipid.get(str(ipid), set())
+            if hdid is not None:
+                ban_ids |= self.by_hdid.get(hdid, set())
+            if ban_id is not None:
+                try:
+                    ban_ids.add(int(ban_id))
+                except ValueError:
+                    pass
+            active = [i for i in ban_ids if i in self.bans]
+            if not active:
+                return None
+            return self.bans[min(active)]
+
+
 class Database:
     """
     Represents a connection to an SQLite database that persists
     information about the server, such as users, bans, and logs.
     """
 
-    def __init__(self):
-        new = not os.path.exists('storage/db.sqlite3')
-        self.db = sqlite3.connect(DB_FILE)
-        self.db.execute('PRAGMA foreign_keys = ON')
-        self.db.row_factory = sqlite3.Row
+    def __init__(self, db_file=DB_FILE):
+        self.db_file = db_file
+        new = not os.path.exists(db_file)
+        self._local = threading.local()
+        self.db = self._connection()
         if new:
             self.migrate_json_to_v1()
         self.migrate()
+        # Lets readers on other threads run while a write is in progress
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.writer = None
+        self.loop = None
+        self._subtype_ids = {}
+        self.aio = AsyncDatabase(self)
+        self.ban_index = BanIndex()
+        self.ban_index.load(self.db)
+
+    def set_event_loop(self, loop):
+        """Set the event loop that runs timed unbans."""
+        self.loop = loop
+
+    def _connection(self):
+        """
+        Get the connection to the database for the current thread,
+        opening it if necessary.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file)
+            conn.execute('PRAGMA foreign_keys = ON')
+            conn.row_factory = sqlite3.Row
+            # SQLite's lower() only folds ASCII characters
+            conn.create_function('py_lower', 1, str.lower, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    def start_writer(self, queue_size=10000, batch_rows=500,
+                     batch_interval=0.25):
+        """
+        Start writing log events from a background thread. Until then,
+        events are written synchronously.
+        """
+        self.writer = EventWriter(self.db_file, queue_size, batch_rows,
+                                  batch_interval)
+        self.writer.start()
+
+    def stop_writer(self):
+        """Write all pending log events and stop the background writer."""
+        if self.writer is None:
+            return
+        self.writer.stop()
+        logger.debug(f'Event writer stopped: {self.writer.written} events '
+                     f'written, {self.writer.dropped} dropped')
+        self.writer = None
+
+    def _log_event(self, sql, params):
+        if self.writer is not None and self.writer.running:
+            self.writer.put(sql, params)
+            return
+        with self._connection() as conn:
+            conn.execute(sql, params)
 
     def migrate_json_to_v1(self):
         """Migrate to v1 of the database from JSON."""
-        with self.db as conn:
+        with self._connection() as conn:
             logger.debug('Initializing database')
             with open('migrations/v1.sql', 'r') as file:
                 conn.executescript(file.read())
@@ -121,11 +393,11 @@ class Database:
             logger.debug('Migration to v1 complete')
 
     def migrate(self):
-        for version in [2, 3, 4, 5, 6]:
+        for version in [2, 3, 4, 5, 6, 7]:
             self.migrate_to_version(version)
 
     def migrate_to_version(self, version):
-        with self.db as conn:
+        with self._connection() as conn:
             cur_version = conn.execute('PRAGMA user_version') \
                 .fetchone()['user_version']
             if cur_version >= version:
@@ -137,7 +409,7 @@ class Database:
 
     def ipid(self, ip):
         """Get an IPID from an IP address."""
-        with self.db as conn:
+        with self._connection() as conn:
             conn.execute(dedent('''
                 INSERT OR IGNORE INTO ipids(ipid, ip_address) VALUES (NULL, ?)
                 '''), (ip, ))
@@ -148,7 +420,7 @@ class Database:
 
     def add_hdid(self, ipid, hdid):
         """Associate an HDID with an IPID."""
-        with self.db as conn:
+        with self._connection() as conn:
             conn.execute(dedent('''
                 INSERT OR IGNORE INTO hdids(hdid, ipid) VALUES (?, ?)
                 '''), (hdid, ipid))
@@ -161,13 +433,15 @@ class Database:
         banned_by=None,
         unban_date=None,
         ban_id=None,
+        special_ban_data=None,
     ):
         """
         Ban an IPID or HDID.
         These should be used sparingly, as they can affect large swaths
         of web users if used incorrectly.
         """
-        with self.db as conn:
+        new_ban = None
+        with self._connection() as conn:
             if ban_id is None:
                 logger.info(
                     f"{banned_by.name} ({banned_by.ipid}) "
@@ -176,12 +450,17 @@ class Database:
                 ban_id = conn.execute(
                     dedent(
                         """
-                    INSERT INTO bans(reason, banned_by, unban_date)
-                    VALUES (?, ?, ?)
+                    INSERT INTO bans(reason, banned_by, unban_date, ban_data)
+                    VALUES (?, ?, ?, ?)
                     """
                     ),
-                    (reason, banned_by.ipid, unban_date),
+                    (reason, banned_by.ipid, unban_date, special_ban_data),
                 ).lastrowid
+                new_ban = Database.Ban(**conn.execute(dedent(
+                    """
+                    SELECT * FROM bans WHERE ban_id = ?
+                    """
+                    ), (ban_id,)).fetchone())
             if ban_type == "ipid":
                 try:
                     conn.execute(
@@ -211,6 +490,13 @@ class Database:
             else:
                 raise ServerError(f"unknown ban type {ban_type}")
 
+        if new_ban is not None:
+            self.ban_index.add(new_ban)
+        if ban_type == "ipid":
+            self.ban_index.add_target(ban_id, ipid=target_id)
+        else:
+            self.ban_index.add_target(ban_id, hdid=target_id)
+
         if unban_date is not None:
             self._schedule_unban(ban_id)
 
@@ -220,7 +506,7 @@ class Database:
         """
         Find the last known OOC name of an IPID.
         """
-        with self.db as conn:
+        with self._connection() as conn:
             row = conn.execute(dedent('''
                 SELECT ooc_name FROM room_events
                 WHERE ipid = ? AND ooc_name IS NOT NULL AND ooc_name != ''
@@ -252,7 +538,7 @@ class Database:
         @property
         def ipids(self):
             """Find IPIDs affected by this ban."""
-            with _database_singleton.db as conn:
+            with _database_singleton._connection() as conn:
                 return [int(row['ipid']) for row in
                     conn.execute(dedent('''
                         SELECT ipid FROM ip_bans WHERE ban_id = ?
@@ -262,7 +548,7 @@ class Database:
         @property
         def hdids(self):
             """Find HDIDs affected by this ban."""
-            with _database_singleton.db as conn:
+            with _database_singleton._connection() as conn:
                 return [row['hdid'] for row in
                     conn.execute(dedent('''
                         SELECT hdid FROM hdid_bans WHERE ban_id = ?
@@ -279,34 +565,11 @@ class Database:
 
     def find_ban(self, ipid=None, hdid=None, ban_id=None):
         """Check if an IPID and/or HDID are banned."""
-        with self.db as conn:
-            # Why is this query so complicated? The answer is that I am
-            # offloading most of the work to SQLite. This query first
-            # finds HDID or IPID bans, then looks up the associated ban
-            # information. Then it finds the last known OOC name of the
-            # player who issued that ban, purely as a convenience
-            # for later use. Use `EXPLAIN QUERY PLAN` for a breakdown.
-            #   LEFT OUTER JOIN room_events ON
-            #      room_events.ipid = banned_by AND
-            #      ooc_name IS NOT NULL
-            #   ORDER BY event_time DESC LIMIT 1
-            ban = conn.execute(dedent('''
-                SELECT *
-                FROM (
-                    SELECT ban_id FROM ip_bans WHERE ipid = ?
-                    UNION SELECT ban_id FROM hdid_bans WHERE hdid = ?
-                    UNION SELECT ban_id FROM bans WHERE ban_id = ?
-                )
-                JOIN bans USING (ban_id) WHERE unbanned = 0
-                '''), (ipid, hdid, ban_id)).fetchone()
-            if ban is not None:
-                return Database.Ban(**ban)
-            else:
-                return None
+        return self.ban_index.find(ipid, hdid, ban_id)
 
     def ban_history(self, ipid=None, hdid=None, ban_id=None):
         """Check if an IPID and/or HDID has been banned in the past."""
-        with self.db as conn:
+        with self._connection() as conn:
             bans = conn.execute(dedent('''
                 SELECT *
                 FROM (
@@ -327,11 +590,15 @@ class Database:
     def unban(self, ban_id):
         """Remove a ban entry."""
         event_logger.info(f'Unbanning {ban_id}')
-        with self.db as conn:
+        with self._connection() as conn:
             unbans = conn.execute(dedent('''
                 UPDATE bans SET unbanned = 1 WHERE ban_id = ?
                 '''), (ban_id,)).rowcount
-            return unbans > 0
+        try:
+            self.ban_index.remove(int(ban_id))
+        except ValueError:
+            pass
+        return unbans > 0
 
     def schedule_unbans(self):
         """
@@ -343,7 +610,7 @@ class Database:
         and then will have to be called again 12 hours later.
         """
         dated_bans = []
-        with self.db as conn:
+        with self._connection() as conn:
             dated_bans = conn.execute(dedent('''
                 SELECT ban_id FROM bans
                 WHERE unban_date IS NOT NULL AND unbanned = 0 AND
@@ -354,28 +621,29 @@ class Database:
             self._schedule_unban(ban['ban_id'])
 
     def _schedule_unban(self, ban_id):
-        with self.db as conn:
+        with self._connection() as conn:
             ban = conn.execute(dedent('''
                 SELECT unban_date FROM bans WHERE unbanned = 0 AND ban_id = ?
                 '''), (ban_id,)).fetchone()
             time_to_unban = (arrow.get(ban['unban_date']) - arrow.utcnow()).total_seconds()
 
             def auto_unban():
-                self.unban(ban_id)
+                self.aio.executor.submit(self.unban, ban_id)
                 self.log_misc('auto_unban', data={'id': ban_id})
 
-            asyncio.get_event_loop().call_later(time_to_unban, auto_unban)
+            # Bans can be issued from the database threads
+            loop = self.loop or asyncio.get_event_loop()
+            loop.call_soon_threadsafe(loop.call_later, time_to_unban, auto_unban)
 
     def log_ic(self, client, room, showname, message):
         """Log an IC message."""
         event_logger.info(f'[{room.abbreviation}] {showname}/{client.char_name}' +
                           f'/{client.name} ({client.ipid}): {message}')
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT INTO ic_events(ipid, room_name, char_name, ic_name,
-                    message) VALUES (?, ?, ?, ?, ?)
-                '''), (client.ipid, room.abbreviation, client.char_name,
-                    showname, message))
+        self._log_event(dedent('''
+            INSERT INTO ic_events(ipid, room_name, char_name, ic_name,
+                message) VALUES (?, ?, ?, ?, ?)
+            '''), (client.ipid, room.abbreviation, client.char_name,
+                showname, message))
 
     def log_room(self, event_subtype, client, room, message=None, target=None):
         """
@@ -392,22 +660,20 @@ class Database:
 
         event_logger.info(f'[{room.abbreviation}] {client.char_name}' +
                     f'/{client.name} ({client.ipid}): event {event_subtype} ({message})')
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT INTO room_events(ipid, room_name, char_name, ooc_name,
-                    event_subtype, message, target_ipid)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                '''), (ipid, room.abbreviation, char_name, ooc_name,
-                    subtype_id, message, target_ipid))
+        self._log_event(dedent('''
+            INSERT INTO room_events(ipid, room_name, char_name, ooc_name,
+                event_subtype, message, target_ipid)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            '''), (ipid, room.abbreviation, char_name, ooc_name,
+                subtype_id, message, target_ipid))
 
     def log_connect(self, client, failed=False):
         """Log a connect attempt."""
         event_logger.info(f'{client.ipid} (HDID: {client.hdid}) ' +
                           f'{"was blocked from connecting" if failed else "connected"}.')
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT INTO connect_events(ipid, hdid, failed) VALUES (?, ?, ?)
-                '''), (client.ipid, client.hdid, failed))
+        self._log_event(dedent('''
+            INSERT INTO connect_events(ipid, hdid, failed) VALUES (?, ?, ?)
+            '''), (client.ipid, client.hdid, failed))
 
     def log_misc(self, event_subtype, client=None, target=None, data=None):
         """
@@ -420,11 +686,10 @@ class Database:
         data_json = json.dumps(data)
         event_logger.info(f'({client_ipid} onto {target_ipid}) - {event_subtype}: {data}')
 
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT INTO misc_events(ipid, target_ipid, event_subtype,
-                    event_data) VALUES (?, ?, ?, ?)
-                '''), (client_ipid, target_ipid, subtype_id, data_json))
+        self._log_event(dedent('''
+            INSERT INTO misc_events(ipid, target_ipid, event_subtype,
+                event_data) VALUES (?, ?, ?, ?)
+            '''), (client_ipid, target_ipid, subtype_id, data_json))
 
     def log_simple(self, event_subtype, client=None, data=None):
         """
@@ -436,17 +701,16 @@ class Database:
         data_json = json.dumps(data)
         event_logger.info(f'{client_ipid} - {event_subtype}: {data}')
 
-        with self.db as conn:
-            conn.execute(dedent('''
-                INSERT INTO misc_events(ipid, event_subtype,
-                    event_data) VALUES (?, ?, ?)
-                '''), (client_ipid, subtype_id, data_json))
+        self._log_event(dedent('''
+            INSERT INTO misc_events(ipid, event_subtype,
+                event_data) VALUES (?, ?, ?)
+            '''), (client_ipid, subtype_id, data_json))
 
     def recent_bans(self, count=5):
         """
         Get the most recent bans in chronological order.
         """
-        with self.db as conn:
+        with self._connection() as conn:
             return [Database.Ban(**row) for row in
                 conn.execute(dedent('''
                     SELECT * FROM (SELECT * FROM bans
@@ -455,137 +719,107 @@ class Database:
                     ORDER BY ban_date ASC
                     '''), (count,)).fetchall()]
 
+    def _recent_distinct(self, table, column, ipid, count, non_empty=True):
+        """
+        Find the most recent distinct values of a column for an IPID,
+        ignoring case. Each value is spelled as it was most recently used.
+        """
+        condition = f"AND {column} IS NOT NULL AND {column} != ''" \
+            if non_empty else ''
+        with self._connection() as conn:
+            return [row['value'] for row in conn.execute(dedent(f'''
+                SELECT value FROM (
+                    SELECT value, last_time, last_row,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY py_lower(value)
+                            ORDER BY last_time DESC, last_row DESC) AS rank
+                    FROM (
+                        SELECT {column} AS value, MAX(event_time) AS last_time,
+                            MAX(rowid) AS last_row
+                        FROM {table}
+                        WHERE ipid = ? {condition}
+                        GROUP BY {column}
+                    )
+                )
+                WHERE rank = 1
+                ORDER BY last_time DESC, last_row DESC LIMIT ?
+                '''), (ipid, count)).fetchall()]
+
     def recent_ooc_names(self, ipid, count=7):
         """
         Find the most recent known OOC names of an IPID.
         """
-        batch_size = 104
-        offset = 0
-        unique_ooc_name = set()
-        unique_ooc_lower = set()
-        result = []
-        with self.db as conn:
-            while len(unique_ooc_name) < count:
-                row = conn.execute(dedent('''
-                SELECT ooc_name FROM room_events
-                WHERE ipid = ? AND ooc_name IS NOT NULL AND ooc_name != ''
-                ORDER BY event_time DESC LIMIT ? OFFSET ?
-                '''), (ipid, batch_size, offset)).fetchall()
-                if not row:
-                    break
-                for r in row:
-                    name = r["ooc_name"]
-                    name_lower = name.lower()
-                    if name_lower not in unique_ooc_lower:
-                        unique_ooc_lower.add(name_lower)
-                        unique_ooc_name.add(name)
-                        result.append(name)
-                        if len(unique_ooc_name) >= count:
-                            break
-                offset += batch_size
-        return result
+        return self._recent_distinct('room_events', 'ooc_name', ipid, count)
 
     def recent_shownames(self, ipid, count=7):
         """
         Find the most recent known Shownames of an IPID.
         """
-        batch_size = 104
-        offset = 0
-        unique_ic_name = set()
-        unique_ic_lower = set()
-        result = []
-        with self.db as conn:
-            while len(unique_ic_name) < count:
-                row = conn.execute(dedent('''
-                SELECT ic_name FROM ic_events
-                WHERE ipid = ? AND ic_name IS NOT NULL AND ic_name != ''
-                ORDER BY event_time DESC LIMIT ? OFFSET ?
-                '''), (ipid, batch_size, offset)).fetchall()
-                if not row:
-                    break
-                for r in row:
-                    name = r["ic_name"]
-                    name_lower = name.lower()
-                    if name_lower not in unique_ic_lower:
-                        unique_ic_lower.add(name_lower)
-                        unique_ic_name.add(name)
-                        result.append(name)
-                        if len(unique_ic_name) >= count:
-                            break
-                offset += batch_size
-        return result
+        return self._recent_distinct('ic_events', 'ic_name', ipid, count)
 
     def char_history(self, ipid, recent_count=7, usage_count=7):
         """
         Find character usage history.
         """
-        batch_size = 104
-        offset = 0
-        unique_chars = set()
+        with self._connection() as conn:
+            # One row per character, most recently used first
+            rows = conn.execute(dedent('''
+                SELECT char_name, COUNT(*) AS uses,
+                    MAX(event_time) AS last_time, MAX(rowid) AS last_row
+                FROM room_events
+                WHERE ipid = ? AND event_subtype = 1 AND char_name IS NOT NULL AND char_name != ''
+                GROUP BY char_name
+                ORDER BY last_time DESC, last_row DESC
+                '''), (ipid,)).fetchall()
+
         unique_chars_lower = set()
         recent_chars = []
-        char_usage_count = Counter()
-        with self.db as conn:
-            while True:
-                row = conn.execute(dedent('''
-                SELECT char_name FROM room_events
-                WHERE ipid = ? AND event_subtype = 1 AND char_name IS NOT NULL AND char_name != ''
-                ORDER BY event_time DESC LIMIT ? OFFSET ?
-                '''), (ipid, batch_size, offset)).fetchall()
-                if not row:
-                    break
-                for r in row:
-                    charname = r["char_name"]
-                    charname_lower = charname.lower()                    
-                    if len(unique_chars) < recent_count and charname_lower not in unique_chars_lower:
-                        unique_chars_lower.add(charname_lower)
-                        unique_chars.add(charname)
-                        recent_chars.append(charname)
-                    char_usage_count[charname] += 1
-                offset += batch_size
-        most_used_chars = [name for name, _ in char_usage_count.most_common(usage_count)]
+        for row in rows:
+            if len(recent_chars) >= recent_count:
+                break
+            charname_lower = row['char_name'].lower()
+            if charname_lower not in unique_chars_lower:
+                unique_chars_lower.add(charname_lower)
+                recent_chars.append(row['char_name'])
+        # Ties are broken by recency (sorted() is stable)
+        most_used_chars = [row['char_name'] for row in
+                           sorted(rows, key=lambda row: row['uses'],
+                                  reverse=True)[:usage_count]]
         return recent_chars, most_used_chars
-    
+
     def hdid_history(self, ipid, count=7):
         """
         Find the most recent known HDIDs of an IPID.
         """
-        batch_size = 104
-        offset = 0
-        unique_hdids = set()
-        unique_hdids_lower = set()
-        result = []
-        with self.db as conn:
-            while len(unique_hdids) < count:
-                row = conn.execute(dedent('''
-                SELECT hdid FROM connect_events
-                WHERE ipid = ?
-                ORDER BY event_time DESC LIMIT ? OFFSET ?
-                '''), (ipid, batch_size, offset)).fetchall()
-                if not row:
-                    break
-                for r in row:
-                    HDID = r["hdid"]
-                    HDID_lower = HDID.lower()
-                    if HDID_lower not in unique_hdids_lower:
-                        unique_hdids_lower.add(HDID_lower)
-                        unique_hdids.add(HDID)
-                        result.append(HDID)
-                        if len(unique_hdids) >= count:
-                            break
-                offset += batch_size
-        return result
+        return self._recent_distinct('connect_events', 'hdid', ipid, count,
+                                     non_empty=False)
+
+    def player_history(self, ipid):
+        """
+        Find everything /whois shows about an IPID: recent and most used
+        characters, recent shownames, OOC names and HDIDs.
+        """
+        recent_chars, most_used_chars = self.char_history(ipid)
+        return (recent_chars, most_used_chars, self.recent_shownames(ipid),
+                self.recent_ooc_names(ipid), self.hdid_history(ipid))
 
     def _subtype_atom(self, event_type, event_subtype):
         if event_type not in ('room', 'misc'):
             raise AssertionError()
 
-        with self.db as conn:
+        # Subtypes are never deleted, so their IDs can be cached
+        key = (event_type, event_subtype)
+        if key in self._subtype_ids:
+            return self._subtype_ids[key]
+
+        with self._connection() as conn:
             conn.execute(dedent(f'''
                 INSERT OR IGNORE INTO {event_type}_event_types(type_name)
                 VALUES (?)
                 '''), (event_subtype,))
-            return conn.execute(dedent(f'''
+            type_id = conn.execute(dedent(f'''
                 SELECT type_id FROM {event_type}_event_types
                 WHERE type_name = ?
                 '''), (event_subtype,)).fetchone()['type_id']
+        self._subtype_ids[key] = type_id
+        return type_id
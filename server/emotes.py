@@ -1,25 +1,127 @@
+import json
 import logging
+import os
 
 from pathlib import Path
 from typing import Union, List
-from configparser import ConfigParser, SectionProxy
+from configparser import ConfigParser, SectionProxy, Error as ConfigParserError
 logger = logging.getLogger('debug')
 
 
+class EmoteCache:
+    """
+    Emote sets parsed from character INI files, persisted to a JSON file
+    so that the INI files do not need to be parsed again on the next start.
+    An entry is only used while the size and modification time of its
+    INI file are unchanged.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # {char name: {'mtime': int, 'size': int, 'emotes': [[preanim, anim, sfx]]}}
+        self.entries = {}
+        self.dirty = False
+
+    def load(self):
+        """Read the cache file, if there is a valid one."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as ex:
+            logger.warn(f'Could not read the emote cache {self.path}: {ex}')
+            return
+        if isinstance(entries, dict):
+            self.entries = entries
+
+    def save(self):
+        """Write the cache file, if anything was added to the cache."""
+        if not self.dirty:
+            return
+        # Entries are replaced rather than modified, so a shallow copy is
+        # enough for the cache to keep being used while it is written
+        entries = dict(self.entries)
+        self.dirty = False
+        tmp_path = f'{self.path}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as file:
+                json.dump(entries, file)
+            os.replace(tmp_path, self.path)
+        except OSError as ex:
+            self.dirty = True
+            logger.warn(f'Could not write the emote cache {self.path}: {ex}')
+
+    def prune(self, names: List[str]):
+        """Remove the entries of characters that are not in `names`."""
+        names = set(names)
+        for name in [name for name in self.entries if name not in names]:
+            del self.entries[name]
+            self.dirty = True
+
+    def get(self, name: str, stat: os.stat_result) -> Union[set, None]:
+        entry = self.entries.get(name)
+        if entry is None or entry.get('mtime') != stat.st_mtime_ns or \
+                entry.get('size') != stat.st_size:
+            return None
+        return {tuple(emote) for emote in entry['emotes']}
+
+    def put(self, name: str, stat: os.stat_result, emotes: set):
+        self.entries[name] = {
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'emotes': sorted(emotes, key=lambda emote: [x or '' for x in emote])
+        }
+        self.dirty = True
+
+
 class Emotes:
     """
     Represents a list of emotes read in from a character INI file
     used for validating which emotes can be sent by clients.
+
+    The INI file is only read when the emotes are first needed, and is
+    not parsed at all if `cache` has an up-to-date copy of them.
     """
     REQUIRED_INI_SECTIONS = ['Options', 'Emotions']
     VALID_EMOTION_SECTIONS = ['number']
 
-    def __init__(self, name: str):
+    def __init__(self, name: str, cache: EmoteCache = None):
         self.CHAR_DIR = 'characters'
         self.name = name
-        self.emotes = set()
+        self.cache = cache
+        self._emotes = None
+
+    @property
+    def emotes(self) -> set:
+        if self._emotes is None:
+            self._load()
+        return self._emotes
+
+    def _load(self):
+        self._emotes = set()
+        char_path = Path(self.CHAR_DIR, self.name, 'char.ini')
+        try:
+            stat = char_path.stat()
+        except OSError:
+            stat = None
+        if stat is not None and self.cache is not None:
+            emotes = self.cache.get(self.name, stat)
+            if emotes is not None:
+                self._emotes = emotes
+                return
 
-        self._add_emotes()
+        try:
+            self._add_emotes()
+        except (ConfigParserError, ValueError, OSError) as ex:
+            # Emotes are loaded while handling an IC message, so a broken
+            # INI file must not take the sender's connection down. With no
+            # emotes, any emote is allowed.
+            logger.warn(f'Could not read the emotes of {self.name}: {ex}')
+            self._emotes = set()
+            return
+        if stat is not None and self.cache is not None:
+            self.cache.put(self.name, stat, self._emotes)
 
     @classmethod
     def _has_valid_ini_sections(cls, char_ini: ConfigParser) -> bool:
@@ -72,10 +174,10 @@ class Emotes:
                 _name, preanim, anim, _mod = emotion_information.split('#')[
                     :4]
                 sfx = self._get_sfx(emote_id, char_ini)
-                self.emotes.add((preanim, anim, sfx))
+                self._emotes.add((preanim, anim, sfx))
 
                 # No SFX should always be allowed
-                self.emotes.add((preanim, anim, None))
+                self._emotes.add((preanim, anim, None))
 
     @staticmethod
     def _get_sfx(emote_id: str, char_ini: ConfigParser) -> Union[str, None]:
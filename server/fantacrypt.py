@@ -21,12 +21,14 @@ An awful encryption scheme from another era.
 
 # fantacrypt was a mistake, just hardcoding some numbers is good enough
 
-import binascii
-
 CRYPT_CONST_1 = 53761
 CRYPT_CONST_2 = 32618
 CRYPT_KEY = 5
 
+# Only the low 16 bits of the key are ever used, so it is kept masked
+# instead of growing into an ever larger integer
+_KEY_MASK = 0xffff
+
 
 def fanta_decrypt(data):
     """
@@ -34,14 +36,16 @@ def fanta_decrypt(data):
     :param data: hex string
 
     """
-    data_bytes = [int(data[x:x + 2], 16) for x in range(0, len(data), 2)]
+    if len(data) % 2:
+        data_bytes = bytes.fromhex(data[:-1]) + bytes([int(data[-1], 16)])
+    else:
+        data_bytes = bytes.fromhex(data)
     key = CRYPT_KEY
-    ret = ''
-    for byte in data_bytes:
-        val = byte ^ ((key & 0xffff) >> 8)
-        ret += chr(val)
-        key = ((byte + key) * CRYPT_CONST_1) + CRYPT_CONST_2
-    return ret
+    ret = bytearray(len(data_bytes))
+    for i, byte in enumerate(data_bytes):
+        ret[i] = byte ^ (key >> 8)
+        key = ((byte + key) * CRYPT_CONST_1 + CRYPT_CONST_2) & _KEY_MASK
+    return ret.decode('latin-1')
 
 
 def fanta_encrypt(data):
@@ -51,10 +55,9 @@ def fanta_encrypt(data):
     :returns: hex-encoded message
     """
     key = CRYPT_KEY
-    ret = ''
-    for char in data:
-        val = ord(char) ^ ((key & 0xffff) >> 8)
-        ret += binascii.hexlify(val.to_bytes(
-            1, byteorder='big')).decode().upper()
-        key = ((val + key) * CRYPT_CONST_1) + CRYPT_CONST_2
-    return ret
+    ret = bytearray(data.encode('latin-1'))
+    for i, byte in enumerate(ret):
+        val = byte ^ (key >> 8)
+        ret[i] = val
+        key = ((val + key) * CRYPT_CONST_1 + CRYPT_CONST_2) & _KEY_MASK
+    return ret.hex().upper()
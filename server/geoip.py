@@ -0,0 +1,136 @@
+# tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Cached lookups of the autonomous system of connecting addresses.
+"""
+
+import logging
+import os
+import time
+from collections import OrderedDict
+
+import geoip2.database
+import geoip2.errors
+import maxminddb
+
+logger = logging.getLogger('debug')
+
+
+class ASNLookup:
+    """
+    Looks up the ASN of IP addresses in a GeoLite2 ASN database, keeping
+    the most recent answers (including addresses that are not in the
+    database) in an LRU cache for `ttl` seconds.
+
+    The database file is checked for changes every `check_interval`
+    seconds; when scripts/update_geoip.sh replaces it, it is reopened
+    and the cache is cleared. If the new file cannot be read (for example
+    because it is still being written), the old one is kept in use.
+    """
+    # Reported for addresses that are not in the database
+    UNKNOWN = 'Loopback'
+
+    def __init__(self, path, max_size=4096, ttl=3600, check_interval=60,
+                 open_reader=geoip2.database.Reader, clock=time.monotonic):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.open_reader = open_reader
+        self.clock = clock
+        self.reader = None
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._file_id = None
+        self._next_check = 0
+        self.reload()
+
+    @property
+    def available(self):
+        """Whether a database is loaded."""
+        return self.reader is not None
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def reload(self):
+        """(Re)open the database file and clear the cache."""
+        try:
+            stat = os.stat(self.path)
+            reader = self.open_reader(self.path)
+        except FileNotFoundError:
+            reader = None
+            stat = None
+        except (maxminddb.InvalidDatabaseError, ValueError, OSError) as ex:
+            # Tried again at the next check
+            logger.warning(f'Could not open {self.path}, '
+                           f'keeping the previous database: {ex}')
+            return
+        if self.reader is not None:
+            self.reader.close()
+        self.reader = reader
+        self._file_id = None if stat is None else \
+            (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        self.cache.clear()
+
+    def _check_file(self, now):
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            stat = os.stat(self.path)
+            file_id = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            file_id = None
+        if file_id != self._file_id:
+            logger.debug(f'{self.path} changed, reloading')
+            self.reload()
+
+    def asn(self, address):
+        """Find the ASN of an address.
+
+        Args:
+            address (str): IPv4 or IPv6 address
+
+        Returns:
+            str: the ASN, or 'Loopback' if it is unknown
+        """
+        now = self.clock()
+        self._check_file(now)
+        if self.reader is None:
+            return self.UNKNOWN
+
+        entry = self.cache.get(address)
+        if entry is not None and entry[1] > now:
+            self.hits += 1
+            self.cache.move_to_end(address)
+            return entry[0]
+
+        self.misses += 1
+        try:
+            asn = str(self.reader.asn(address).autonomous_system_number)
+        except geoip2.errors.AddressNotFoundError:
+            asn = self.UNKNOWN
+        self.cache[address] = (asn, now + self.ttl)
+        self.cache.move_to_end(address)
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return asn
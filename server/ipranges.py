@@ -0,0 +1,172 @@
+# tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Matching of connecting addresses against the rules of iprange_ban.txt.
+"""
+
+import ipaddress
+import logging
+
+logger = logging.getLogger('debug')
+
+
+class IPRangeMatcher:
+    """
+    A compiled list of banned IP ranges and autonomous systems.
+
+    Each line of the list can be:
+    - an ASN, e.g. `13335`
+    - a range in CIDR notation, e.g. `23.129.64.0/24` or `2001:db8::/32`
+    - a single address
+    - a list of leading octets (or IPv6 groups), e.g. `23.129.64.`,
+      which covers the addresses starting with those octets
+    - leading octets without the trailing dot, e.g. `104.244.7`, which
+      covers the addresses starting with that text, as in older versions
+      (here 104.244.7.x and 104.244.70.x to 104.244.79.x)
+    Empty lines and lines starting with `#` are ignored.
+
+    Ranges are kept in one hash table per prefix length, so a lookup
+    costs one dictionary access per distinct prefix length in the list,
+    no matter how many rules there are.
+    """
+
+    def __init__(self):
+        # {prefix length: {network bits: line}}
+        self.ranges = {4: {}, 6: {}}
+        self._lengths = {4: [], 6: []}
+        self.asns = {}
+
+    @classmethod
+    def from_lines(cls, lines):
+        """Compile a list of rules. The ID of a rule is its line number."""
+        matcher = cls()
+        for line, rule in enumerate(lines):
+            matcher.add(rule, line)
+        return matcher
+
+    def __len__(self):
+        return len(self.asns) + sum(len(networks)
+                                    for version in self.ranges.values()
+                                    for networks in version.values())
+
+    def add(self, rule, line):
+        """Add a rule. Earlier rules take precedence for identical ranges.
+
+        Args:
+            rule (str): rule as written in the list
+            line (int): ID reported when the rule matches
+
+        Returns:
+            bool: whether the rule was valid
+        """
+        rule = rule.strip()
+        if rule == '' or rule.startswith('#'):
+            return False
+        if rule.isdigit():
+            self.asns.setdefault(rule, line)
+            return True
+        try:
+            networks = self.parse_range(rule)
+        except ValueError:
+            logger.debug(f'Invalid IP range ban on line {line}: {rule}')
+            return False
+
+        for network in networks:
+            self._add_network(network, line)
+        return True
+
+    def _add_network(self, network, line):
+        version = network.version
+        bits = network.max_prefixlen - network.prefixlen
+        networks = self.ranges[version].setdefault(network.prefixlen, {})
+        networks.setdefault(int(network.network_address) >> bits, line)
+        if network.prefixlen not in self._lengths[version]:
+            self._lengths[version].append(network.prefixlen)
+            self._lengths[version].sort()
+
+    @staticmethod
+    def parse_range(rule):
+        """Parse a range rule into the networks it covers.
+
+        Raises:
+            ValueError: the rule is not a valid range
+        """
+        if '/' in rule:
+            return [ipaddress.ip_network(rule, strict=False)]
+        if ':' in rule:
+            groups = rule.split(':')
+            if rule.endswith(':') and not rule.endswith('::'):
+                # Leading groups only
+                groups = groups[:-1]
+                if len(groups) >= 8:
+                    raise ValueError(rule)
+                return [ipaddress.IPv6Network(
+                    (':'.join(groups) + '::', 16 * len(groups)))]
+            return [ipaddress.IPv6Network(rule)]
+        partial = not rule.endswith('.')
+        octets = rule.split('.') if partial else rule[:-1].split('.')
+        if not 1 <= len(octets) <= 4:
+            raise ValueError(rule)
+        if not partial or len(octets) == 4:
+            address = '.'.join(octets + ['0'] * (4 - len(octets)))
+            return [ipaddress.IPv4Network((address, 8 * len(octets)))]
+
+        # The last octet is only the start of one: `7` stands for 7,
+        # 70 to 79 and 700 to 799, of which the valid octets are kept
+        last = octets[-1]
+        if not last.isdigit() or (last.startswith('0') and last != '0'):
+            raise ValueError(rule)
+        start = int(last)
+        values = {start} if start == 0 else \
+            {start} | set(range(start * 10, start * 10 + 10)) | \
+            set(range(start * 100, start * 100 + 100))
+        networks = []
+        for value in sorted(v for v in values if v <= 255):
+            address = '.'.join(octets[:-1] + [str(value)] +
+                               ['0'] * (4 - len(octets)))
+            networks.append(
+                ipaddress.IPv4Network((address, 8 * len(octets))))
+        if not networks:
+            raise ValueError(rule)
+        return list(ipaddress.collapse_addresses(networks))
+
+    def match(self, address, asn=None):
+        """Find the first rule that covers an address or its ASN.
+
+        Args:
+            address (str): IPv4 or IPv6 address
+            asn (str, optional): autonomous system number of the address
+
+        Returns:
+            int: line of the matching rule, or None if there is none
+        """
+        found = self.asns.get(asn) if asn is not None else None
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return found
+        if ip.version == 6 and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+
+        value = int(ip)
+        ranges = self.ranges[ip.version]
+        for length in self._lengths[ip.version]:
+            line = ranges[length].get(value >> (ip.max_prefixlen - length))
+            if line is not None and (found is None or line < found):
+                found = line
+        return found
@@ -0,0 +1,81 @@
+# tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+
+from server.exceptions import ServerError
+
+logger = logging.getLogger('debug')
+
+
+def is_valid_song_name(song_name: str) -> bool:
+    return '.' in song_name
+
+
+class MusicCatalogue:
+    """
+    A compiled music list, as loaded from music.yaml.
+
+    Tracks and categories are indexed by name, and the lists sent to
+    AO2 and AO1 clients are built once, when the catalogue is created.
+    """
+
+    def __init__(self, music_list):
+        self.music_list = music_list
+        # {name: (name, length)}, categories have a length of -1
+        self.tracks = {}
+        self.categories = set()
+        self.list_ao2 = []
+        for item in music_list:
+            if 'category' not in item: #skip settings n stuff
+                continue
+            category = item['category']
+            self.categories.add(category)
+            # When a name is used several times, the first one wins
+            self.tracks.setdefault(category, (category, -1))
+            self.list_ao2.append(category)
+            for song in item['songs']:
+                self.tracks.setdefault(song['name'],
+                                       (song['name'], song.get('length', -1)))
+                if is_valid_song_name(song['name']):
+                    self.list_ao2.append(song['name'])
+                else:
+                    logger.debug(f"{song['name']} is not a valid song name")
+
+        songs = [f'{index}#{name}' for index, name in enumerate(self.list_ao2)]
+        self.pages_ao1 = [songs[x:x + 10] for x in range(0, len(songs), 10)]
+
+    def get(self, name: str):
+        """Get information about a track.
+
+        Args:
+            name (str): track name
+
+        Raises:
+            ServerError: the track does not exist
+
+        Returns:
+            tuple: (name, length or -1)
+        """
+        try:
+            return self.tracks[name]
+        except KeyError:
+            raise ServerError('Music not found.')
+
+    def is_category(self, name: str) -> bool:
+        """Get whether a track is a category."""
+        return name in self.categories
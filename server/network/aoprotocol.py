@@ -15,71 +15,58 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import re
 import arrow
 import asyncio
 import logging
-import unicodedata
 import json
 
-from enum import Enum
 from typing import List
 from time import localtime, strftime, time
 
 from .. import commands
-from server import database
+from server import database, sanitize
 from server.fantacrypt import fanta_decrypt
-from server.constants import ESCAPE_CHARACTERS
 from server.exceptions import ClientError, AreaError, ArgumentError, ServerError
+from server.network import schemas
+from server.network.framing import FrameBuffer, ProtocolError
+from server.network.schemas import ArgType
 
 
 logger_debug = logging.getLogger('debug')
 logger = logging.getLogger('events')
 
 
-class ProtocolError(Exception):
-    pass
-
-
 class AOProtocol(asyncio.Protocol):
     """The main class that deals with the AO protocol."""
     last_message_char_id: int = -1
 
-    class ArgType(Enum):
-        """Represents the data type of an argument for a network command."""
-        STR = 1,
-        STR_OR_EMPTY = 2,
-        INT = 3,
-        INT_OR_STR = 3
+    ArgType = ArgType
+
+    # Features advertised to clients in the FL packet
+    FEATURES = ('yellowtext', 'customobjections', 'flipping', 'fastloading',
+                'noencryption', 'deskmod', 'evidence', 'modcall_reason',
+                'cccc_ic_support', 'arup', 'casing_alerts', 'prezoom',
+                'looping_sfx', 'additive', 'effects', 'y_offset',
+                'expanded_desk_mods', 'auth_packet')
 
     def __init__(self, server):
         super().__init__()
         self.server = server
         self.client = None
-        self.buffer = ''
+        self.buffer = FrameBuffer()
         self.ping_timeout = None
+        self.handshake = None
+        self.handshake_timeout = None
+        # Address the connection is counted as pending admission for
+        self.pending = None
+        self.encrypted = True
 
     def dezalgo(self, input):
         """
         Turns any string into a de-zalgo'd version, with a tolerance to allow for normal diacritic use.
-
-        The following Unicode blocks are scrubbed:
-        U+0300 - U+036F - COMBINING DIACRITICAL MARKS
-        U+1AB0 - U+1AFF - COMBINING DIACRITICAL MARKS EXTENDED
-        U+1DC0 - U+1DFF - COMBINING DIACRITICAL MARKS SUPPLEMENT
-        U+20D0 - U+20FF - COMBINING DIACRITICAL MARKS FOR SYMBOLS
-        U+FE20 - U+FE2F - COMBINING HALF MARKS
-        U+115F          - HANGUL CHOSEONG FILLER
-        U+1160          - HANGUL JUNGSEONG FILLER
-        U+3164          - HANGUL FILLER
+        See server.sanitize for the list of scrubbed characters.
         """
-
-        filtered = re.sub('([\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f' +
-                          '\u115f\u1160\u3164]' +
-                          '{' +
-                          re.escape(str(self.server.zalgo_tolerance)) + ',})',
-                          '', input)
-        return filtered
+        return sanitize.dezalgo(input, self.server.zalgo_tolerance)
 
     def data_received(self, data):
         """Handles any data received from the network.
@@ -90,71 +77,100 @@ class AOProtocol(asyncio.Protocol):
         :param data: bytes of data
 
         """
-        buf = data
-        ipid = self.client.ipid
+        if data is None:
+            data = b''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer.feed(data)
 
-        if buf is None:
-            buf = b''
-
-        if not isinstance(buf, str):
-            # try to decode as utf-8, ignore any erroneous characters
-            self.buffer += buf.decode('utf-8', 'ignore')
-        else:
-            self.buffer = buf
-
-        self.buffer = self.buffer.translate({ord(c): None for c in '\0'})
-
-        if len(self.buffer) > 8192:
+        if self.buffer.overflowed:
             self.client.disconnect()
         try:
-            for msg in self.get_messages():
-                if len(msg) < 2:
-                    continue
-                # general netcode structure is not great
-                if msg[0] in ('#', '3', '4'):
-                    if msg[0] == '#':
-                        msg = msg[1:]
-                    spl = msg.split('#', 1)
-                    msg = '#'.join([fanta_decrypt(spl[0])] + spl[1:])
-                try:
-                    cmd, *args = msg.split('#')
-                    self.net_cmd_dispatcher[cmd](self, args)
-                    if cmd != 'CH':
-                        self.client.last_pkt_time = time()
-                except KeyError:
-                    logger_debug.debug(
-                        f'Unknown incoming message from {ipid}: {msg}')
-                    if not self.client.is_checked:
-                        raise ProtocolError
+            for msg in self.buffer.frames():
+                self.packet_received(msg)
         except ProtocolError:
             self.client.disconnect()
 
+    def packet_received(self, msg):
+        """Handles a single packet and passes it to the command handler.
+
+        :param msg: packet, without the trailing delimiter
+        :raises: ProtocolError if the client should be disconnected
+
+        """
+        if len(msg) < 2:
+            return
+        # general netcode structure is not great
+        encrypted = self.encrypted and msg[0] in ('#', '3', '4')
+        if encrypted:
+            if msg[0] == '#':
+                msg = msg[1:]
+            spl = msg.split('#', 1)
+            msg = '#'.join([fanta_decrypt(spl[0])] + spl[1:])
+        try:
+            cmd, *args = msg.split('#')
+            # Keyed by address, as the IPID is only known after HI
+            if not self.server.rate_limiter.allow(self.client.address, cmd):
+                return
+            if cmd == 'ID' and not encrypted:
+                # The client is sent FL with noencryption in reply,
+                # so none of its later packets are encrypted
+                self.encrypted = False
+            self.net_cmd_dispatcher[cmd](self, args)
+            if cmd != 'CH':
+                self.client.last_pkt_time = time()
+        except KeyError:
+            logger_debug.debug(
+                f'Unknown incoming message from {self.client.ipid}: {msg}')
+            if not self.client.is_checked:
+                raise ProtocolError
+
     def connection_made(self, transport):
         """Called upon a new client connecting
 
         :param transport: the transport object
         """
+        # Anything costly (IPID and GeoIP lookups, bans, joining an area)
+        # waits until the client has sent HI
+        address = transport.get_extra_info('peername')[0]
+        if not self.server.admission.admit(address):
+            transport.close()
+            return
+        self.pending = address
         try:
             self.client = self.server.new_client(transport)
         except ClientError:
+            self.release_pending()
             transport.close()
             return
 
-        if not self.server.client_manager.new_client_preauth(self.client):
-            self.client.send_command(
-                'BD', 'Maximum clients reached.\nDisconnect one of your clients to continue.')
-            self.client.disconnect()
-            return
+        limits = self.server.config['outbound_buffer']
+        transport.set_write_buffer_limits(high=limits['high_water'],
+                                          low=limits['low_water'])
 
         # Client needs to send CHECK#% within the timeout - otherwise,
         # it will be automatically dropped.
         self.ping_timeout = asyncio.get_event_loop().call_later(
             self.server.config['timeout'], self.client.disconnect)
+        # The handshake has a shorter timeout of its own
+        self.handshake_timeout = asyncio.get_event_loop().call_later(
+            self.server.config['admission']['handshake_timeout'],
+            self.client.disconnect)
 
         asyncio.get_event_loop().call_later(0.25, self.client.send_command,
                                             'decryptor',
                                             34)  # just fantacrypt things)
 
+    def pause_writing(self):
+        """Called when the transport's buffer goes over the high water mark."""
+        if self.client is not None:
+            self.client.pause_writing()
+
+    def resume_writing(self):
+        """Called when the transport's buffer drains below the low water mark."""
+        if self.client is not None:
+            self.client.resume_writing()
+
     def connection_lost(self, exc):
         """User disconnected
 
@@ -166,21 +182,17 @@ class AOProtocol(asyncio.Protocol):
             self.server.remove_client(self.client)
         if self.ping_timeout is not None:
             self.ping_timeout.cancel()
-
-    def get_messages(self):
-        """Parses out full messages from the buffer.
-
-        :return: yields messages
-
-        """
-        # Long header - not likely to be a valid message
-        if len(self.buffer) >= 24 and '#' not in self.buffer[:24]:
-            raise ProtocolError
-
-        while '#%' in self.buffer:
-            spl = self.buffer.split('#%', 1)
-            self.buffer = spl[1]
-            yield spl[0]
+        if self.handshake_timeout is not None:
+            self.handshake_timeout.cancel()
+        if self.handshake is not None:
+            self.handshake.cancel()
+        self.release_pending()
+
+    def release_pending(self):
+        """Stop counting the connection as pending admission."""
+        if self.pending is not None:
+            self.server.admission.release(self.pending)
+            self.pending = None
 
     def validate_net_cmd(self, args, *types, needs_auth=True):
         """Makes sure the net command's arguments match expectations.
@@ -206,6 +218,25 @@ class AOProtocol(asyncio.Protocol):
                     return False
         return True
 
+    def parse_net_cmd(self, command, args):
+        """Parses the arguments of a net command with several layouts.
+
+        The layout is picked by the number of arguments (see
+        `server.network.schemas`).
+
+        :param command: name of the net command
+        :param args: actual arguments to the net command
+        :returns: a record of the parsed arguments, or None if they
+        do not match any layout
+
+        """
+        schema = schemas.lookup(command, len(args))
+        if schema is None:
+            return None
+        if schema.needs_auth and self.client.char_id == -1:
+            return None
+        return schema.parse(args)
+
     def net_cmd_hi(self, args):
         """Handshake.
 
@@ -214,55 +245,101 @@ class AOProtocol(asyncio.Protocol):
         :param args: a list containing all the arguments
 
         """
-        if self.client.is_checked:
+        if self.client.is_checked or self.handshake is not None:
             self.client.disconnect()
             return
 
         if not self.validate_net_cmd(args, self.ArgType.STR, needs_auth=False):
             return
-        hdid = self.client.hdid = args[0]
-        ipid = self.client.ipid
+        self.server.client_manager.set_hdid(self.client, args[0])
+        self.handshake = asyncio.ensure_future(self.finish_handshake())
 
-        database.add_hdid(ipid, hdid)
+    async def finish_handshake(self):
+        """Look up the client's IPID, check its bans and let it in.
+        The client is disconnected if anything goes wrong, rather than
+        being left half-admitted until the handshake timeout.
+        """
+        try:
+            await self._finish_handshake()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Exception during the handshake')
+            self.client.disconnect()
+
+    async def _finish_handshake(self):
+        # The database is queried off the event loop, so the client may
+        # have disconnected in the meantime
+        client = self.client
+        hdid = client.hdid
+
+        ipid = await database.aio.ipid(client.address)
+        if client not in self.server.client_manager.clients:
+            return
+
+        line = self.server.ip_range_ban(client.address)
+        if line is not None:
+            msg =   'Abuse\r\n'
+            msg += f'ID: {line}\r\n'
+            msg +=  'Until: N/A'
+            client.send_command('BD', msg)
+            client.disconnect()
+            return
+
+        self.server.client_manager.set_ipid(client, ipid)
+        if not self.server.client_manager.new_client_preauth(client):
+            client.send_command(
+                'BD', 'Maximum clients reached.\nDisconnect one of your clients to continue.')
+            client.disconnect()
+            return
+
+        await database.aio.add_hdid(ipid, hdid)
+        if client not in self.server.client_manager.clients:
+            return
         ban = database.find_ban(ipid, hdid)
 
+        special_ban_data = None
         if ban is not None:
             try:
                 special_ban_data = json.loads(ban.ban_data)
             except (ValueError, TypeError):
                 special_ban_data = None
 
-            if special_ban_data is not None:
-                try:
-                    if special_ban_data['ban_type'] == 'area_curse':
-                        self.client.area_curse = special_ban_data['target_area']
-                        self.client.area_curse_info = ban
-                        self.client.change_area(self.server.area_manager.get_area_by_id(self.client.area_curse))
-                except (KeyError, ValueError):
-                    pass
-            else:
+            if special_ban_data is None:
                 if ban.unban_date is not None:
-                    unban_date = arrow.get(ban.unban_date)
+                    unban_date = arrow.get(ban.unban_date).humanize()
                 else:
                     unban_date = 'N/A'
 
                 msg = f'{ban.reason}\r\n'
                 msg += f'ID: {ban.ban_id}\r\n'
-                msg += f'Until: {unban_date.humanize()}'
+                msg += f'Until: {unban_date}'
 
-                database.log_connect(self.client, failed=True)
-                self.client.send_command('BD', msg)
-                self.client.disconnect()
+                database.log_connect(client, failed=True)
+                client.send_command('BD', msg)
+                client.disconnect()
                 return
 
-        self.client.is_checked = True
-
-        database.log_connect(self.client, failed=False)
-        self.client.send_command('ID', self.client.id, self.server.software,
-                                 self.server.version)
-        self.client.send_command('PN',
-                                 self.server.player_count,
-                                 self.server.config['playerlimit'])
+        client.area.new_client(client)
+        if special_ban_data is not None:
+            try:
+                if special_ban_data['ban_type'] == 'area_curse':
+                    client.area_curse = special_ban_data['target_area']
+                    client.area_curse_info = ban
+                    client.change_area(self.server.area_manager.get_area_by_id(client.area_curse))
+            except (KeyError, ValueError):
+                pass
+
+        client.is_checked = True
+        self.handshake_timeout.cancel()
+        self.release_pending()
+
+        database.log_connect(client, failed=False)
+        client.send_command('ID', client.id, self.server.software,
+                            self.server.version)
+        client.send_command('PN',
+                            self.server.player_count,
+                            self.server.config['playerlimit'])
 
     def net_cmd_id(self, args):
         """Client version and PV
@@ -279,12 +356,8 @@ class AOProtocol(asyncio.Protocol):
             self.client.minor_version = version[2]
             
         
-        self.client.send_command('FL', 'yellowtext', 'customobjections',
-                                 'flipping', 'fastloading', 'noencryption',
-                                 'deskmod', 'evidence', 'modcall_reason',
-                                 'cccc_ic_support', 'arup', 'casing_alerts',
-                                 'prezoom', 'looping_sfx', 'additive', 'effects',
-                                 'y_offset', 'expanded_desk_mods', 'auth_packet')
+        self.client.send_bytes(self.server.get_cached_command(
+            'FL', lambda: ('FL', *self.FEATURES)))
 
         # Send Asset packet if asset_url is defined
         if self.server.config['asset_url'] != None:
@@ -315,7 +388,7 @@ class AOProtocol(asyncio.Protocol):
 
         askchar2#%
         """
-        self.client.send_command('CI', *self.server.char_pages_ao1[0])
+        self.send_char_page(0)
 
     def net_cmd_an(self, args):
         """Asks for specific pages of the character list.
@@ -326,10 +399,9 @@ class AOProtocol(asyncio.Protocol):
         if not self.validate_net_cmd(args, self.ArgType.INT, needs_auth=False):
             return
         if len(self.server.char_pages_ao1) > args[0] >= 0:
-            self.client.send_command('CI',
-                                     *self.server.char_pages_ao1[args[0]])
+            self.send_char_page(args[0])
         else:
-            self.client.send_command('EM', *self.server.music_pages_ao1[0])
+            self.send_music_page(0)
 
     def net_cmd_ae(self, _):
         """Asks for specific pages of the evidence list.
@@ -350,8 +422,7 @@ class AOProtocol(asyncio.Protocol):
         if not self.validate_net_cmd(args, self.ArgType.INT, needs_auth=False):
             return
         if len(self.server.music_pages_ao1) > args[0] >= 0:
-            self.client.send_command('EM',
-                                     *self.server.music_pages_ao1[args[0]])
+            self.send_music_page(args[0])
         else:
             self.client.send_done()
             self.client.send_area_list()
@@ -363,13 +434,8 @@ class AOProtocol(asyncio.Protocol):
         AC#%
 
         """
-        for i, char in enumerate(self.server.char_list):
-            for esc in ESCAPE_CHARACTERS.keys():
-                if esc in char:
-                    char = char.replace(esc, ESCAPE_CHARACTERS[esc])
-            self.server.char_list[i] = char
-
-        self.client.send_command('SC', *self.server.char_list)
+        self.client.send_bytes(self.server.get_cached_command(
+            'SC', lambda: ('SC', *self.server.get_escaped_char_list())))
 
     def net_cmd_rm(self, _):
         """Asks for the whole music list (AO2)
@@ -377,14 +443,20 @@ class AOProtocol(asyncio.Protocol):
         AM#%
 
         """
+        self.client.send_bytes(self.server.get_cached_command(
+            'SM', lambda: ('SM',
+                           *[a.name for a in self.server.area_manager.areas],
+                           *self.server.music_list_ao2)))
 
-        song_list = []
-        allowed = self.client in self.client.area.owners or self.client.is_mod
-        song_list += [a.name for a in self.server.area_manager.areas]
+    def send_char_page(self, page):
+        """Send a page of the character list (AO1)."""
+        self.client.send_bytes(self.server.get_cached_command(
+            ('CI', page), lambda: ('CI', *self.server.char_pages_ao1[page])))
 
-        song_list += self.server.music_list_ao2
-
-        self.client.send_command('SM', *song_list)
+    def send_music_page(self, page):
+        """Send a page of the music list (AO1)."""
+        self.client.send_bytes(self.server.get_cached_command(
+            ('EM', page), lambda: ('EM', *self.server.music_pages_ao1[page])))
 
     def net_cmd_rd(self, _):
         """Asks for server metadata(charscheck, motd etc.) and a DONE#% signal(also best packet)
@@ -436,66 +508,22 @@ class AOProtocol(asyncio.Protocol):
             return
 
         target_area = []
-        showname = ""
-        charid_pair = -1
-        offset_pair = ""
-        nonint_pre = 0
-        sfx_looping = "0"
-        screenshake = 0
-        frames_shake = ""
-        frames_realization = ""
-        frames_sfx = ""
-        additive = 0
-        effect = ""
+        record = self.parse_net_cmd('MS', args)
+        if record is None:
+            return
+        args = list(record)
+        msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color, showname, charid_pair, offset_pair, nonint_pre, sfx_looping, screenshake, frames_shake, frames_realization, frames_sfx, additive, effect = record
         pair_order = 0
-        if self.validate_net_cmd(args, self.ArgType.STR,  # msg_type
-                                 self.ArgType.STR_OR_EMPTY, self.ArgType.STR,   # pre, folder
-                                 self.ArgType.STR, self.ArgType.STR_OR_EMPTY,   # anim, text
-                                 self.ArgType.STR, self.ArgType.STR,            # pos, sfx
-                                 self.ArgType.INT, self.ArgType.INT,            # anim_type, cid
-                                 self.ArgType.INT, self.ArgType.INT_OR_STR,     # sfx_delay, button
-                                 self.ArgType.INT, self.ArgType.INT,            # evidence, flip
-                                 self.ArgType.INT, self.ArgType.INT,            # ding, color
-                                 ):
-            # Pre-2.6 validation monstrosity.
-            msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color = args
-        elif self.validate_net_cmd(
-            args, self.ArgType.STR, self.ArgType.STR_OR_EMPTY,              # msg_type, pre
-            self.ArgType.STR, self.ArgType.STR, self.ArgType.STR_OR_EMPTY,  # folder, anim, text
-            self.ArgType.STR, self.ArgType.STR, self.ArgType.INT,           # pos, sfx, anim_type
-            self.ArgType.INT, self.ArgType.INT, self.ArgType.INT_OR_STR,    # cid, sfx_delay, button
-            self.ArgType.INT, self.ArgType.INT, self.ArgType.INT,           # evidence, flip, ding
-            # color, showname, charid_pair
-            self.ArgType.INT, self.ArgType.STR_OR_EMPTY, self.ArgType.INT,
-            # offset_pair, nonint_pre
-            self.ArgType.STR, self.ArgType.INT,
-        ):
-            # 2.6 validation monstrosity.
-            msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color, showname, charid_pair, offset_pair, nonint_pre = args
-        elif self.validate_net_cmd(
-            args, self.ArgType.STR, self.ArgType.STR_OR_EMPTY,              # msg_type, pre
-            self.ArgType.STR, self.ArgType.STR, self.ArgType.STR_OR_EMPTY,  # folder, anim, text
-            self.ArgType.STR, self.ArgType.STR, self.ArgType.INT,           # pos, sfx, anim_type
-            self.ArgType.INT, self.ArgType.INT, self.ArgType.INT_OR_STR,    # cid, sfx_delay, button
-            self.ArgType.INT, self.ArgType.INT, self.ArgType.INT,           # evidence, flip, ding
-            # color, showname, charid_pair
-            self.ArgType.INT, self.ArgType.STR_OR_EMPTY, self.ArgType.STR,
-            # offset_pair, nonint_pre, sfx_looping
-            self.ArgType.STR, self.ArgType.INT, self.ArgType.STR,
-            # screenshake, frames_shake, frames_realization
-            self.ArgType.INT, self.ArgType.STR, self.ArgType.STR,
-            # frames_sfx, additive, effect
-            self.ArgType.STR, self.ArgType.INT, self.ArgType.STR,
-        ):
-            # 2.8 validation monstrosity. (rip 2.7)
-            msg_type, pre, folder, anim, text, pos, sfx, anim_type, cid, sfx_delay, button, evidence, flip, ding, color, showname, charid_pair, offset_pair, nonint_pre, sfx_looping, screenshake, frames_shake, frames_realization, frames_sfx, additive, effect = args
+        if isinstance(charid_pair, str):
+            # 2.8 sends the pair order along with the character ID.
             pair_args = charid_pair.split("^")
-            charid_pair = int(pair_args[0])
+            try:
+                charid_pair = int(pair_args[0])
+            except ValueError:
+                return
             if (len(pair_args) > 1):
                 pair_order = pair_args[1]
-        else:
-            return        
-        
+
         if additive == 1 and self.client.area.client_can_additive(self.client):
             additive = 1
         else:
@@ -522,8 +550,7 @@ class AOProtocol(asyncio.Protocol):
                 self.client.send_ooc(
                     "Blankposting is forbidden in this area!")
                 return
-            if len(re.sub(r'[{}\\`|(~~)]', '', text).replace(
-                    ' ', '')) < 3 and not text.startswith('<') and not text.startswith('>'):
+            if sanitize.is_spammy(text):
                 self.client.send_ooc(
                     "While that is not a blankpost, it is still pretty spammy. Try forming sentences."
                 )
@@ -789,7 +816,7 @@ class AOProtocol(asyncio.Protocol):
             return
         if self.client.name != args[0] and self.client.fake_name != args[0]:
             if self.client.is_valid_name(args[0]):
-                self.client.name = args[0]
+                self.server.client_manager.set_name(self.client, args[0])
                 self.client.fake_name = args[0]
             else:
                 self.client.fake_name = args[0]
@@ -801,11 +828,10 @@ class AOProtocol(asyncio.Protocol):
             self.client.send_ooc(
                 'Your OOC name is too long! Limit it to 30 characters.')
             return
-        for c in self.client.name:
-            if unicodedata.category(c) == 'Cf':
-                self.client.send_ooc(
-                    'You cannot use format characters in your name!')
-                return
+        if sanitize.has_format_characters(self.client.name):
+            self.client.send_ooc(
+                'You cannot use format characters in your name!')
+            return
         if self.client.name.startswith(
                 self.server.config['hostname']) or self.client.name.startswith(
                     '<dollar>G') or self.client.name.startswith('<dollar>M'):
@@ -883,13 +909,11 @@ class AOProtocol(asyncio.Protocol):
                 )
                 return
 
-            if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT):
-                if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT, self.ArgType.STR_OR_EMPTY):
-                    if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT, self.ArgType.STR_OR_EMPTY, self.ArgType.INT):
-                        if not self.validate_net_cmd(args, self.ArgType.STR, self.ArgType.INT, self.ArgType.STR_OR_EMPTY, self.ArgType.INT, self.ArgType.INT):
-                            return
+            record = self.parse_net_cmd('MC', args)
+            if record is None:
+                return
 
-            if args[1] != self.client.char_id:
+            if record.cid != self.client.char_id:
                 return
             if self.client.change_music_cd():
                 if (len(self.client.area.clients) != 1):
@@ -898,26 +922,22 @@ class AOProtocol(asyncio.Protocol):
                     )
                     return
             try:
-                if args[0] == "~stop.mp3" or self.server.get_song_is_category(self.server.music_list, args[0]):
+                if record.name == "~stop.mp3" or self.server.get_song_is_category(self.server.music_list, record.name):
                     name, length = "~stop.mp3", 0
                 else:
                     name, length = self.server.get_song_data(
-                        self.server.music_list, args[0])
+                        self.server.music_list, record.name)
 
                 # Showname info
-                showname = ''
-                if len(args) > 2:
-                    showname = args[2]
-                    if len(showname) > 0 and not self.client.area.showname_changes_allowed:
-                        self.client.send_ooc(
-                            "Showname changes are forbidden in this area!"
-                        )
-                        return
+                showname = record.showname
+                if len(showname) > 0 and not self.client.area.showname_changes_allowed:
+                    self.client.send_ooc(
+                        "Showname changes are forbidden in this area!"
+                    )
+                    return
 
                 # Effects info
-                effects = 0
-                if len(args) > 3:
-                    effects = int(args[3])
+                effects = record.effects
 
                 # Jukebox check
                 if self.client.area.jukebox:
@@ -962,15 +982,14 @@ class AOProtocol(asyncio.Protocol):
                 "You are not on the area's invite list, and thus, you cannot use the WTCE buttons!"
             )
             return
-        if not self.validate_net_cmd(
-                args, self.ArgType.STR) and not self.validate_net_cmd(
-                    args, self.ArgType.STR, self.ArgType.INT):
+        record = self.parse_net_cmd('RT', args)
+        if record is None:
             return
-        if args[0] == 'testimony1':
+        if record.sign == 'testimony1':
             sign = 'WT'
-        elif args[0] == 'testimony2':
+        elif record.sign == 'testimony2':
             sign = 'CE'
-        elif args[0] == 'judgeruling':
+        elif record.sign == 'judgeruling':
             sign = 'JR'
         else:
             return
@@ -979,10 +998,10 @@ class AOProtocol(asyncio.Protocol):
                 'You used witness testimony/cross examination signs too many times. Please try again after {} seconds.'
                 .format(int(self.client.wtce_mute())))
             return
-        if len(args) == 1:
-            self.client.area.send_command('RT', args[0])
-        elif len(args) == 2:
-            self.client.area.send_command('RT', args[0], args[1])
+        if record.variant is None:
+            self.client.area.send_command('RT', record.sign)
+        else:
+            self.client.area.send_command('RT', record.sign, record.variant)
         self.client.area.add_to_judgelog(self.client, f'used {sign}')
         database.log_room('wtce', self.client, self.client.area, message=sign)
 
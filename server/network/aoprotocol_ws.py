@@ -16,20 +16,42 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import logging
 
 from websockets import ConnectionClosed
 
 from server.network.aoprotocol import AOProtocol
+from server.network.framing import ProtocolError
+from server.network.ratelimit import TokenBucket
+
+logger = logging.getLogger('debug')
 
 
 class AOProtocolWS(AOProtocol):
     """A websocket wrapper around AOProtocol."""
 
     class TransportWrapper:
-        """A class to wrap asyncio's Transport class."""
+        """A class to wrap asyncio's Transport class.
+
+        Written messages are queued and sent by a single writer task,
+        which sends everything queued since its last send as one
+        WebSocket message. Like asyncio's transports, it tells the
+        protocol to pause writing when more than the high water mark
+        is queued, and to resume once the queue drains below the low
+        water mark.
+        """
 
-        def __init__(self, websocket):
+        def __init__(self, websocket, protocol):
             self.ws = websocket
+            self.protocol = protocol
+            self.queue = []
+            self.queue_size = 0
+            self.high_water = 65536
+            self.low_water = 16384
+            self.write_paused = False
+            self.closing = False
+            self.wakeup = asyncio.Event()
+            self.writer = asyncio.ensure_future(self.ws_writer())
 
         def get_extra_info(self, key):
             """Get extra info about the client.
@@ -41,49 +63,146 @@ class AOProtocolWS(AOProtocol):
             info = {'peername': self.ws.remote_address}
             return info[key]
 
+        def get_write_buffer_size(self):
+            """Get the number of bytes waiting to be sent."""
+            return self.queue_size
+
         def write(self, message):
-            """Write message to the socket.
+            """Queue a message to be written to the socket.
 
             :param message: message in bytes
 
             """
-            message = message.decode('utf-8')
-            asyncio.ensure_future(self.ws_try_writing_message(message))
+            if self.closing:
+                return
+            self.queue.append(message)
+            self.queue_size += len(message)
+            self.wakeup.set()
+            if not self.write_paused and self.queue_size > self.high_water:
+                self.write_paused = True
+                self.protocol.pause_writing()
 
         def close(self):
-            """Disconnect the client by force."""
+            """Disconnect the client once the queued messages are sent."""
+            if self.closing:
+                return
+            self.closing = True
+            self.wakeup.set()
+
+        def abort(self):
+            """Disconnect the client without waiting for pending writes."""
+            self.closing = True
+            self.queue.clear()
+            self.queue_size = 0
+            self.writer.cancel()
             asyncio.ensure_future(self.ws.close())
 
-        async def ws_try_writing_message(self, message):
+        def set_write_buffer_limits(self, high=None, low=None):
+            """Set the write buffer limits of the transport.
+
+            :param high: high water mark in bytes
+            :param low: low water mark in bytes
+
             """
-            Try writing the message if the client has not already closed
-            the connection.
+            if high is not None:
+                self.high_water = high
+            if low is not None:
+                self.low_water = low
+
+        async def ws_writer(self):
+            """
+            Send the queued messages until the transport is closed or the
+            client closes the connection.
             """
             try:
-                await self.ws.send(message)
+                while not self.closing or self.queue:
+                    await self.wakeup.wait()
+                    self.wakeup.clear()
+                    while self.queue:
+                        batch = b''.join(self.queue)
+                        self.queue.clear()
+                        self.queue_size = 0
+                        # webAO only understands text frames
+                        await self.ws.send(batch.decode('utf-8'))
+                        if self.write_paused and \
+                                self.queue_size <= self.low_water:
+                            self.write_paused = False
+                            self.protocol.resume_writing()
+                await self.ws.close()
             except ConnectionClosed:
-                return
+                self.closing = True
+                self.queue.clear()
+                self.queue_size = 0
 
     def __init__(self, server, websocket):
         super().__init__(server)
         self.ws = websocket
         self.ws_connected = True
+        limits = server.config['websocket_limits']
+        self.rate_limit = TokenBucket(limits['messages_per_second'],
+                                      limits['burst'])
 
         self.ws_on_connect()
 
     def ws_on_connect(self):
         """Handle a new client connection."""
-        self.connection_made(self.TransportWrapper(self.ws))
+        self.transport = self.TransportWrapper(self.ws, self)
+        self.connection_made(self.transport)
+
+    def connection_lost(self, exc):
+        super().connection_lost(exc)
+        self.transport.abort()
 
     async def ws_handle(self):
+        """
+        Receive messages until the connection is closed. Clients that send
+        messages faster than the rate limit are not read from until they
+        are within the limit again, which pushes back on them through the
+        websockets library and TCP.
+        """
+        if self.client is None:
+            # Rejected in connection_made
+            self.ws_connected = False
+            return
+        exc = None
         try:
-            data = await self.ws.recv()
-            self.data_received(data)
-        except Exception as exc:
-            # Any event handled in data_received could raise any exception
+            async for message in self.ws:
+                delay = self.rate_limit.delay()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.rate_limit.consume()
+                self.message_received(message)
+        except ConnectionClosed:
+            pass
+        except Exception as ex:
+            # Any event handled in packet_received could raise any exception
+            logger.exception('Exception while handling a WebSocket message')
+            exc = ex
+        if self.ws_connected:
             self.ws_connected = False
             self.connection_lost(exc)
 
+    def message_received(self, message):
+        """Handle a WebSocket message, which holds one or more whole
+        packets. Unlike TCP data, messages are never split across
+        packets, so they are not buffered.
+
+        :param message: str (or bytes, for binary messages)
+
+        """
+        if isinstance(message, bytes):
+            message = message.decode('utf-8', 'ignore')
+        if '\0' in message:
+            message = message.replace('\0', '')
+        *packets, rest = message.split('#%')
+        if rest != '':
+            logger.debug(f'Incomplete packet from {self.client.ipid}: {rest}')
+        try:
+            for packet in packets:
+                self.packet_received(packet)
+        except ProtocolError:
+            self.client.disconnect()
+
 
 def new_websocket_client(server):
     """
@@ -93,7 +212,6 @@ def new_websocket_client(server):
     """
     async def func(websocket, _):
         client = AOProtocolWS(server, websocket)
-        while client.ws_connected:
-            await client.ws_handle()
+        await client.ws_handle()
 
     return func
@@ -0,0 +1,95 @@
+# tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Splits the raw byte stream of a connection into AO packets.
+"""
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class FrameBuffer:
+    """
+    Accumulates bytes received from the network and yields complete
+    packets (terminated by `#%`) as they become available.
+
+    Incoming data is only scanned once: the search for a delimiter
+    resumes where the previous one left off, and all complete packets
+    are split off and dropped from the buffer in a single pass.
+    """
+    DELIMITER = b'#%'
+    # Anything this long without a '#' cannot be a packet header.
+    MAX_HEADER_LENGTH = 24
+    MAX_SIZE = 8192
+
+    def __init__(self, max_size: int = MAX_SIZE):
+        self.buffer = bytearray()
+        self.max_size = max_size
+        self._scan_offset = 0
+
+    def __len__(self):
+        return len(self.buffer)
+
+    @property
+    def overflowed(self) -> bool:
+        """Whether the unparsed data exceeds the size limit."""
+        return len(self.buffer) > self.max_size
+
+    def feed(self, data: bytes):
+        """Append raw data received from the network.
+
+        Args:
+            data (bytes): raw data
+        """
+        self.buffer += data
+
+    def frames(self):
+        """Parse out full packets from the buffer.
+
+        NUL characters are stripped and each packet is decoded as UTF-8,
+        ignoring any erroneous characters.
+
+        Raises:
+            ProtocolError: the buffer does not start with a valid header
+
+        Returns:
+            yields packets without the trailing delimiter
+        """
+        buf = self.buffer
+        header = buf[:self.MAX_HEADER_LENGTH].replace(b'\0', b'')
+        if len(header) >= self.MAX_HEADER_LENGTH and b'#' not in header:
+            raise ProtocolError
+
+        end = buf.rfind(self.DELIMITER, self._scan_offset)
+        if end == -1:
+            # The delimiter may be split across two reads, so the next
+            # scan has to start one byte before the current end.
+            self._scan_offset = max(len(buf) - len(self.DELIMITER) + 1, 0)
+            return
+
+        # Everything up to the last delimiter is complete, so it can be
+        # split and dropped from the buffer in one go.
+        frames = buf[:end].split(self.DELIMITER)
+        del buf[:end + len(self.DELIMITER)]
+        self._scan_offset = 0
+
+        for frame in frames:
+            if b'\0' in frame:
+                frame = frame.replace(b'\0', b'')
+            yield frame.decode('utf-8', 'ignore')
@@ -0,0 +1,163 @@
+# tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Rate limiting of incoming connections and messages.
+"""
+
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """
+    A token bucket: it holds up to `burst` tokens, and is refilled at
+    `rate` tokens per second. Each message takes tokens out of it, and
+    messages that find the bucket empty are over the limit.
+    """
+
+    def __init__(self, rate: float, burst: float, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, cost: float = 1) -> bool:
+        """Take tokens out of the bucket, if there are enough of them.
+
+        Args:
+            cost (float): number of tokens to take
+
+        Returns:
+            bool: whether the tokens were taken
+        """
+        self._refill()
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+    def delay(self, cost: float = 1) -> float:
+        """Get the number of seconds until `cost` tokens are available."""
+        self._refill()
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Limits the packets received from each sender with a token bucket per
+    key (the IPID, so that multiclients share their bucket). Each command
+    costs `costs[command]` tokens, or `default_cost` if it is not listed;
+    commands that cost nothing are never limited.
+
+    At most `max_size` buckets are kept. The least recently used one is
+    forgotten when a new one is needed, so both the time and the memory
+    taken per packet are constant.
+    """
+
+    def __init__(self, rate: float, burst: float, costs: dict = None,
+                 default_cost: float = 1, max_size: int = 4096,
+                 clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.costs = costs or {}
+        self.default_cost = default_cost
+        self.max_size = max_size
+        self.clock = clock
+        self.buckets = OrderedDict()
+        self.dropped = 0
+
+    def allow(self, key, command: str) -> bool:
+        """Take the cost of a packet from the bucket of its sender.
+
+        Args:
+            key: sender of the packet
+            command (str): command name of the packet
+
+        Returns:
+            bool: whether the packet is within the limit
+        """
+        cost = self.costs.get(command, self.default_cost)
+        if cost <= 0:
+            return True
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.burst, self.clock)
+            self.buckets[key] = bucket
+            if len(self.buckets) > self.max_size:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        if bucket.consume(cost):
+            return True
+        self.dropped += 1
+        return False
+
+
+class Admission:
+    """
+    Decides whether to accept new connections. Each address may open
+    `accept_burst` connections at once, and then `accept_rate` per second.
+    At most `max_pending` clients may be connected without having
+    completed the handshake, and at most `max_pending_per_address` of
+    them from the same address, so that a few addresses cannot hold
+    every slot.
+    """
+
+    def __init__(self, accept_rate: float, accept_burst: float,
+                 max_pending: int, max_pending_per_address: int = 4,
+                 max_size: int = 4096, clock=time.monotonic):
+        self.accepts = RateLimiter(accept_rate, accept_burst,
+                                   max_size=max_size, clock=clock)
+        self.max_pending = max_pending
+        self.max_pending_per_address = max_pending_per_address
+        self.pending = 0
+        # {address: number of pending connections}
+        self.pending_by_address = {}
+        self.rejected = 0
+
+    def admit(self, address) -> bool:
+        """Count a new connection from an address as pending, if it may
+        be accepted. Each admitted connection must be released."""
+        pending = self.pending_by_address.get(address, 0)
+        if self.pending >= self.max_pending or \
+                pending >= self.max_pending_per_address or \
+                not self.accepts.allow(address, 'connect'):
+            self.rejected += 1
+            return False
+        self.pending += 1
+        self.pending_by_address[address] = pending + 1
+        return True
+
+    def release(self, address):
+        """Stop counting a connection from an address as pending, because
+        it completed or failed the handshake."""
+        self.pending -= 1
+        pending = self.pending_by_address[address] - 1
+        if pending:
+            self.pending_by_address[address] = pending
+        else:
+            del self.pending_by_address[address]
@@ -0,0 +1,125 @@
+# tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Argument layouts of network commands that have more than one version.
+
+Each layout is registered under its command name and argument count,
+so an incoming packet is matched to its layout with a single dict lookup
+and parsed in one pass.
+"""
+
+from collections import namedtuple
+from enum import Enum
+
+
+class ArgType(Enum):
+    """Represents the data type of an argument for a network command."""
+    STR = 1,
+    STR_OR_EMPTY = 2,
+    INT = 3,
+    INT_OR_STR = 3
+
+
+class NetCommandSchema:
+    """A single argument layout of a network command."""
+    __slots__ = ('command', 'record', 'types', 'needs_auth')
+
+    def __init__(self, command, record, types, needs_auth=True):
+        self.command = command
+        self.record = record
+        self.types = types
+        self.needs_auth = needs_auth
+
+    def parse(self, args):
+        """Convert the arguments of a packet into a record.
+
+        :param args: arguments of the packet
+        :returns: a record, or None if an argument is invalid
+
+        """
+        values = []
+        for arg, arg_type in zip(args, self.types):
+            if arg_type is not ArgType.STR_OR_EMPTY and len(arg) == 0:
+                return None
+            if arg_type is ArgType.INT:
+                try:
+                    arg = int(arg)
+                except ValueError:
+                    return None
+            values.append(arg)
+        return self.record(*values)
+
+
+_schemas = {}
+
+
+def register(command, record, *types, needs_auth=True):
+    """Register an argument layout of a network command."""
+    _schemas[(command, len(types))] = NetCommandSchema(command, record, types,
+                                                       needs_auth)
+
+
+def lookup(command, arg_count):
+    """Find the layout of a command with the given number of arguments."""
+    return _schemas.get((command, arg_count))
+
+
+MSArgs = namedtuple('MSArgs', [
+    'msg_type', 'pre', 'folder', 'anim', 'text', 'pos', 'sfx', 'anim_type',
+    'cid', 'sfx_delay', 'button', 'evidence', 'flip', 'ding', 'color',
+    # 2.6
+    'showname', 'charid_pair', 'offset_pair', 'nonint_pre',
+    # 2.8
+    'sfx_looping', 'screenshake', 'frames_shake', 'frames_realization',
+    'frames_sfx', 'additive', 'effect'
+], defaults=('', -1, '', 0, '0', 0, '', '', '', 0, ''))
+
+_MS_PRE_26 = (
+    ArgType.STR, ArgType.STR_OR_EMPTY, ArgType.STR,     # msg_type, pre, folder
+    ArgType.STR, ArgType.STR_OR_EMPTY, ArgType.STR,     # anim, text, pos
+    ArgType.STR, ArgType.INT, ArgType.INT,              # sfx, anim_type, cid
+    ArgType.INT, ArgType.INT_OR_STR, ArgType.INT,       # sfx_delay, button, evidence
+    ArgType.INT, ArgType.INT, ArgType.INT,              # flip, ding, color
+)
+# Pre-2.6 validation monstrosity.
+register('MS', MSArgs, *_MS_PRE_26)
+# 2.6 validation monstrosity.
+register('MS', MSArgs, *_MS_PRE_26,
+         ArgType.STR_OR_EMPTY, ArgType.INT,             # showname, charid_pair
+         ArgType.STR, ArgType.INT)                      # offset_pair, nonint_pre
+# 2.8 validation monstrosity. (rip 2.7)
+register('MS', MSArgs, *_MS_PRE_26,
+         ArgType.STR_OR_EMPTY, ArgType.STR,             # showname, charid_pair
+         ArgType.STR, ArgType.INT, ArgType.STR,         # offset_pair, nonint_pre, sfx_looping
+         ArgType.INT, ArgType.STR, ArgType.STR,         # screenshake, frames_shake, frames_realization
+         ArgType.STR, ArgType.INT, ArgType.STR)         # frames_sfx, additive, effect
+
+MCArgs = namedtuple('MCArgs', ['name', 'cid', 'showname', 'effects', 'extra'],
+                    defaults=('', 0, 0))
+
+register('MC', MCArgs, ArgType.STR, ArgType.INT)
+register('MC', MCArgs, ArgType.STR, ArgType.INT, ArgType.STR_OR_EMPTY)
+register('MC', MCArgs, ArgType.STR, ArgType.INT, ArgType.STR_OR_EMPTY,
+         ArgType.INT)
+register('MC', MCArgs, ArgType.STR, ArgType.INT, ArgType.STR_OR_EMPTY,
+         ArgType.INT, ArgType.INT)
+
+RTArgs = namedtuple('RTArgs', ['sign', 'variant'], defaults=(None,))
+
+register('RT', RTArgs, ArgType.STR)
+register('RT', RTArgs, ArgType.STR, ArgType.INT)
@@ -0,0 +1,40 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+pytest.importorskip('arrow')
+
+from server import database
+from server.network.aoprotocol import AOProtocol
+
+
+class AsyncDatabase:
+    async def ipid(self, address):
+        raise sqlite3.OperationalError('database is locked')
+
+
+class Database:
+    aio = AsyncDatabase()
+
+
+class Client:
+    address = '127.0.0.1'
+    hdid = 'hdid'
+    is_checked = False
+
+    def __init__(self):
+        self.disconnected = False
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+def test_failed_handshake_disconnects(monkeypatch):
+    monkeypatch.setattr(database, '_database_singleton', Database())
+    protocol = AOProtocol(server=None)
+    protocol.client = Client()
+
+    asyncio.run(protocol.finish_handshake())
+    assert protocol.client.disconnected
+    assert not protocol.client.is_checked
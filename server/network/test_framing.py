@@ -0,0 +1,36 @@
+import pytest
+
+from server.network.framing import FrameBuffer, ProtocolError
+
+
+def parse(*chunks):
+    buffer = FrameBuffer()
+    frames = []
+    for chunk in chunks:
+        buffer.feed(chunk)
+        frames += list(buffer.frames())
+    return frames, buffer
+
+
+def test_pipelined_frames():
+    frames, buffer = parse(b'HI#abc#%ID#1#AO2#2.9#%CH#%')
+    assert frames == ['HI#abc', 'ID#1#AO2#2.9', 'CH']
+    assert len(buffer) == 0
+
+
+def test_split_delimiter_and_codepoint():
+    data = 'CT#name#café#%'.encode('utf-8')
+    chunks = [data[i:i + 1] for i in range(len(data))]
+    frames, buffer = parse(*chunks)
+    assert frames == ['CT#name#café']
+    assert len(buffer) == 0
+
+
+def test_nul_stripping():
+    frames, _ = parse(b'CH\0#%\0\0MS#a#%')
+    assert frames == ['CH', 'MS#a']
+
+
+def test_long_header():
+    with pytest.raises(ProtocolError):
+        parse(b'x' * 30)
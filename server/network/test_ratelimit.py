@@ -0,0 +1,75 @@
+from server.network.ratelimit import Admission, RateLimiter, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    assert all(bucket.consume() for _ in range(3))
+    assert not bucket.consume()
+    assert bucket.delay() == 0.5
+
+    clock.now += 0.5
+    assert bucket.delay() == 0
+    assert bucket.consume()
+    assert not bucket.consume()
+
+    # Never refilled past the burst size
+    clock.now += 60
+    assert bucket.consume(3)
+    assert not bucket.consume()
+
+
+def test_rate_limiter():
+    clock = Clock()
+    limiter = RateLimiter(rate=1, burst=4, costs={'CH': 0, 'ZZ': 3},
+                          max_size=2, clock=clock)
+    assert limiter.allow('a', 'ZZ')
+    assert limiter.allow('a', 'CT')
+    assert not limiter.allow('a', 'MS')
+    assert limiter.allow('a', 'CH')
+    assert limiter.dropped == 1
+    # Other senders have their own bucket
+    assert limiter.allow('b', 'ZZ')
+
+    # Only the most recently used buckets are kept
+    limiter.allow('c', 'MS')
+    assert list(limiter.buckets) == ['b', 'c']
+
+
+def test_admission():
+    clock = Clock()
+    admission = Admission(accept_rate=1, accept_burst=2, max_pending=3,
+                          clock=clock)
+    assert admission.admit('1.1.1.1')
+    assert admission.admit('1.1.1.1')
+    assert not admission.admit('1.1.1.1')
+    assert admission.admit('2.2.2.2')
+    # Too many clients have not finished the handshake
+    assert not admission.admit('3.3.3.3')
+    admission.release('1.1.1.1')
+    assert admission.admit('3.3.3.3')
+    assert admission.rejected == 2
+
+
+def test_admission_per_address():
+    clock = Clock()
+    admission = Admission(accept_rate=1, accept_burst=10, max_pending=10,
+                          max_pending_per_address=2, clock=clock)
+    assert admission.admit('1.1.1.1')
+    assert admission.admit('1.1.1.1')
+    # One address cannot hold every pending slot
+    assert not admission.admit('1.1.1.1')
+    assert admission.admit('2.2.2.2')
+
+    admission.release('1.1.1.1')
+    assert admission.admit('1.1.1.1')
+    admission.release('2.2.2.2')
+    assert admission.pending_by_address == {'1.1.1.1': 2}
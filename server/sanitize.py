@@ -0,0 +1,81 @@
+# tsuserver3, an Attorney Online server
+#
+# Copyright (C) 2016 argoneus <argoneuscze@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Checks and clean-up of the text sent by clients in IC and OOC messages.
+"""
+
+import functools
+import re
+import unicodedata
+
+# Characters that are scrubbed when enough of them are stacked together:
+# U+0300 - U+036F - COMBINING DIACRITICAL MARKS
+# U+1AB0 - U+1AFF - COMBINING DIACRITICAL MARKS EXTENDED
+# U+1DC0 - U+1DFF - COMBINING DIACRITICAL MARKS SUPPLEMENT
+# U+20D0 - U+20FF - COMBINING DIACRITICAL MARKS FOR SYMBOLS
+# U+FE20 - U+FE2F - COMBINING HALF MARKS
+# U+115F          - HANGUL CHOSEONG FILLER
+# U+1160          - HANGUL JUNGSEONG FILLER
+# U+3164          - HANGUL FILLER
+ZALGO_CHARACTERS = ('\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff'
+                    '\ufe20-\ufe2f\u115f\u1160\u3164')
+
+# Characters that do not count towards the length of an IC message when
+# checking for blankposts: markup characters and spaces
+_BLANKPOST_FILLER = re.compile(r'[{}\\`|(~) ]')
+
+
+@functools.lru_cache(maxsize=None)
+def zalgo_pattern(tolerance: int) -> re.Pattern:
+    """Get the compiled pattern matching runs of `tolerance` or more
+    zalgo characters."""
+    return re.compile(f'[{ZALGO_CHARACTERS}]{{{int(tolerance)},}}')
+
+
+def dezalgo(text: str, tolerance: int) -> str:
+    """
+    Turns any string into a de-zalgo'd version, with a tolerance to allow
+    for normal diacritic use: runs of fewer than `tolerance` zalgo
+    characters are kept. Nothing is removed if `tolerance` is None.
+    """
+    if tolerance is None or text.isascii():
+        return text
+    return zalgo_pattern(tolerance).sub('', text)
+
+
+def visible_length(text: str) -> int:
+    """Get the length of an IC message, not counting markup characters
+    and spaces."""
+    return len(_BLANKPOST_FILLER.sub('', text))
+
+
+def is_spammy(text: str) -> bool:
+    """
+    Get whether an IC message has too little text to be worth sending.
+    Messages starting with `<` or `>` are allowed, as they are used to
+    move through testimonies.
+    """
+    return visible_length(text) < 3 and not text.startswith(('<', '>'))
+
+
+def has_format_characters(text: str) -> bool:
+    """Get whether a string contains invisible formatting characters
+    (Unicode category Cf), such as zero-width spaces."""
+    if text.isascii():
+        return False
+    return any(unicodedata.category(c) == 'Cf' for c in text)
@@ -0,0 +1,104 @@
+import pytest
+
+pytest.importorskip('arrow')
+
+from server.client_manager import ClientManager
+from server.constants import TargetType
+
+
+class Transport:
+    def __init__(self, address):
+        self.address = address
+
+    def get_extra_info(self, key):
+        return {'peername': (self.address, 0)}[key]
+
+
+class Area:
+    jukebox = False
+
+    def __init__(self, area_id):
+        self.id = area_id
+        self.clients = set()
+        self.afkers = []
+        self.owners = []
+
+
+class AreaManager:
+    def __init__(self):
+        self.areas = [Area(0), Area(1)]
+
+    def default_area(self):
+        return self.areas[0]
+
+
+class Server:
+    def __init__(self):
+        self.config = {
+            'playerlimit': 10,
+            'multiclient_limit': 2,
+            'wtce_floodguard': {'times_per_interval': 1, 'interval_length': 0},
+            'music_change_floodguard': {'times_per_interval': 1,
+                                        'interval_length': 0},
+        }
+        self.area_manager = AreaManager()
+        self.char_list = ['Phoenix', 'Edgeworth', 'Maya']
+
+
+def test_multiclient_indexes():
+    manager = ClientManager(Server())
+    a, b, c = [manager.new_client(Transport('127.0.0.1')) for _ in range(3)]
+    for client, hdid in ((a, 'one'), (b, 'two'), (c, 'two')):
+        manager.set_hdid(client, hdid)
+        manager.set_ipid(client, 1 if client is not c else 2)
+
+    assert manager.new_client_preauth(a)
+    assert set(manager.get_multiclients(1, 'two')) == {a, b, c}
+    assert set(manager.get_multiclients(2, 'none')) == {c}
+
+    d = manager.new_client(Transport('127.0.0.1'))
+    manager.set_ipid(d, 1)
+    assert not manager.new_client_preauth(d)
+
+    manager.remove_client(d)
+    manager.remove_client(b)
+    assert manager.new_client_preauth(a)
+    assert set(manager.get_multiclients(1, 'two')) == {a, c}
+    assert manager.clients_by_ipid == {1: {a}, 2: {c}}
+
+
+def test_get_targets():
+    manager = ClientManager(Server())
+    a, b, c, d = [manager.new_client(Transport('127.0.0.1'))
+                  for _ in range(4)]
+    for client, ipid in ((a, 1), (b, 1), (c, 2)):
+        manager.set_ipid(client, ipid)
+        client.area.clients.add(client)
+    c.area = manager.server.area_manager.areas[1]
+    c.area.clients.add(c)
+    manager.set_char_id(a, 0)
+    manager.set_char_id(c, 0)
+    manager.set_name(b, 'Bob')
+    manager.set_name(d, 'Dee')
+
+    def targets(key, value, local=False):
+        return manager.get_targets(a, key, value, local)
+
+    assert targets(TargetType.ID, b.id) == [b]
+    assert targets(TargetType.ID, d.id) == []
+    assert targets(TargetType.IPID, 1) == [a, b]
+    assert targets(TargetType.CHAR_NAME, 'phoenix hi') == [a, c]
+    assert targets(TargetType.CHAR_NAME, 'phoenix', local=True) == [a]
+    assert targets(TargetType.CHAR_NAME, 'Spectator') == [b]
+    assert targets(TargetType.OOC_NAME, 'bob hello') == [b]
+    assert targets(TargetType.OOC_NAME, 'dee') == []
+
+    manager.set_name(b, 'Robert')
+    manager.set_char_id(c, 1)
+    assert targets(TargetType.OOC_NAME, 'bob') == []
+    assert targets(TargetType.OOC_NAME, 'robert') == [b]
+    assert targets(TargetType.CHAR_NAME, 'edgeworth') == [c]
+
+    manager.remove_client(b)
+    assert targets(TargetType.IPID, 1) == [a]
+    assert manager.clients_by_name == {'': {a, c}, 'dee': {d}}
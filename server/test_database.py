@@ -0,0 +1,119 @@
+import os
+import random
+import sqlite3
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('arrow')
+
+from server import database
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+NAMES = ['Phoenix', 'phoenix', 'PHOENIX', 'Maya', 'maya', 'Édgeworth',
+         'édgeworth', 'Godot', 'Larry', 'Pearl', 'Apollo', 'Athena', '']
+
+
+def legacy_recent(conn, table, column, ipid, count=7, non_empty=True):
+    """The OFFSET-paging algorithm the history lookups used to use."""
+    condition = f"AND {column} IS NOT NULL AND {column} != ''" if non_empty else ''
+    seen, result, offset = set(), [], 0
+    while len(result) < count:
+        rows = conn.execute(f'''
+            SELECT {column} FROM {table} WHERE ipid = ? {condition}
+            ORDER BY event_time DESC LIMIT 104 OFFSET ?
+            ''', (ipid, offset)).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            if row[0].lower() not in seen:
+                seen.add(row[0].lower())
+                result.append(row[0])
+                if len(result) >= count:
+                    break
+        offset += 104
+    return result
+
+
+def legacy_char_history(conn, ipid):
+    seen, recent, usage = set(), [], Counter()
+    for row in conn.execute('''
+            SELECT char_name FROM room_events
+            WHERE ipid = ? AND event_subtype = 1 AND char_name IS NOT NULL AND char_name != ''
+            ORDER BY event_time DESC
+            ''', (ipid,)).fetchall():
+        if len(recent) < 7 and row[0].lower() not in seen:
+            seen.add(row[0].lower())
+            recent.append(row[0])
+        usage[row[0]] += 1
+    return recent, [name for name, _ in usage.most_common(7)]
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.chdir(ROOT)
+    db = database.Database(str(tmp_path / 'test.sqlite3'))
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+    with db.db as conn:
+        conn.execute('PRAGMA foreign_keys = OFF')
+        char = db._subtype_atom('room', 'char')
+        ooc = db._subtype_atom('room', 'ooc')
+        assert char == 1
+        for i in range(30000):
+            time = (start + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S')
+            ipid = rng.randrange(10)
+            table = rng.randrange(3)
+            if table == 0:
+                conn.execute('''
+                    INSERT INTO room_events(event_time, ipid, char_name,
+                        ooc_name, event_subtype) VALUES (?, ?, ?, ?, ?)
+                    ''', (time, ipid, rng.choice(NAMES), rng.choice(NAMES),
+                          rng.choice((char, ooc))))
+            elif table == 1:
+                conn.execute('''
+                    INSERT INTO ic_events(event_time, ipid, ic_name, message)
+                    VALUES (?, ?, ?, 'Objection!')
+                    ''', (time, ipid, rng.choice(NAMES)))
+            else:
+                conn.execute('''
+                    INSERT INTO connect_events(event_time, ipid, hdid)
+                    VALUES (?, ?, ?)
+                    ''', (time, ipid, rng.choice(NAMES)))
+    return db
+
+
+def test_history_matches_legacy(db):
+    conn = db.db
+    for ipid in range(11):
+        assert db.recent_ooc_names(ipid) == \
+            legacy_recent(conn, 'room_events', 'ooc_name', ipid)
+        assert db.recent_shownames(ipid) == \
+            legacy_recent(conn, 'ic_events', 'ic_name', ipid)
+        assert db.hdid_history(ipid) == \
+            legacy_recent(conn, 'connect_events', 'hdid', ipid, non_empty=False)
+        assert db.char_history(ipid) == legacy_char_history(conn, ipid)
+
+
+def test_event_writer_counts(tmp_path):
+    path = str(tmp_path / 'events.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE events(id INTEGER PRIMARY KEY)')
+    writer = database.EventWriter(path)
+    insert = 'INSERT INTO events(id) VALUES (?)'
+
+    # A failed batch is rolled back, so none of it counts as written
+    writer._write(conn, [(insert, (1,)), (insert, (1,)),
+                         ('INSERT INTO missing VALUES (?)', (1,))])
+    assert (writer.written, writer.dropped) == (0, 3)
+
+    writer._write(conn, [(insert, (2,)), (insert, (2,))])
+    assert (writer.written, writer.dropped) == (1, 4)
+    assert conn.execute('SELECT id FROM events').fetchall() == [(2,)]
+
+    writer.start()
+    for i in range(10, 20):
+        writer.put(insert, (i,))
+    writer.stop()
+    assert (writer.written, writer.dropped) == (11, 4)
@@ -0,0 +1,53 @@
+from server.emotes import EmoteCache, Emotes
+
+CHAR_INI = '''[Options]
+name = Phoenix
+
+[Emotions]
+number = 2
+1 = Normal#-#normal#0#
+2 = Point#point#pointing#1#
+
+[SoundN]
+1 = 1
+2 = sfx-deskslam
+'''
+
+
+def test_lazy_and_cached(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'characters' / 'Phoenix').mkdir(parents=True)
+    (tmp_path / 'characters' / 'Phoenix' / 'char.ini').write_text(CHAR_INI)
+
+    cache = EmoteCache('emote_cache.json')
+    emotes = Emotes('Phoenix', cache)
+    assert 'Phoenix' not in cache.entries
+    assert emotes.validate('point', 'pointing', 'sfx-deskslam')
+    assert emotes.validate('-', 'normal', None)
+    assert not emotes.validate('-', 'thinking', None)
+    cache.save()
+
+    warm = EmoteCache('emote_cache.json')
+    warm.load()
+    monkeypatch.setattr(Emotes, '_add_emotes', lambda self: 1 / 0)
+    assert Emotes('Phoenix', warm).emotes == emotes.emotes
+
+    # A modified INI file is parsed again
+    (tmp_path / 'characters' / 'Phoenix' / 'char.ini').write_text(
+        CHAR_INI + '\n')
+    assert warm.get('Phoenix', (tmp_path / 'characters' / 'Phoenix' /
+                                'char.ini').stat()) is None
+
+
+def test_broken_ini(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'characters' / 'Phoenix').mkdir(parents=True)
+    (tmp_path / 'characters' / 'Phoenix' / 'char.ini').write_text(
+        CHAR_INI.replace('2 = Point#point#pointing#1#', '2 = Point'))
+
+    cache = EmoteCache('emote_cache.json')
+    emotes = Emotes('Phoenix', cache)
+    # The emotes that were read before the error are not kept
+    assert emotes.emotes == set()
+    assert emotes.validate('-', 'thinking', None)
+    assert 'Phoenix' not in cache.entries
@@ -1,7 +1,49 @@
-from server.fantacrypt import fanta_decrypt, fanta_encrypt
+import random
+
+from server.fantacrypt import fanta_decrypt, fanta_encrypt, CRYPT_CONST_1, \
+    CRYPT_CONST_2, CRYPT_KEY
+
+
+def reference_decrypt(data):
+    """fanta_decrypt as it was first written, one character at a time."""
+    data_bytes = [int(data[x:x + 2], 16) for x in range(0, len(data), 2)]
+    key = CRYPT_KEY
+    ret = ''
+    for byte in data_bytes:
+        val = byte ^ ((key & 0xffff) >> 8)
+        ret += chr(val)
+        key = ((byte + key) * CRYPT_CONST_1) + CRYPT_CONST_2
+    return ret
+
+
+def reference_encrypt(data):
+    """fanta_encrypt as it was first written, one character at a time."""
+    key = CRYPT_KEY
+    ret = ''
+    for char in data:
+        val = ord(char) ^ ((key & 0xffff) >> 8)
+        ret += '{:02X}'.format(val)
+        key = ((val + key) * CRYPT_CONST_1) + CRYPT_CONST_2
+    return ret
+
 
 def test_fanta_decrypt():
     assert fanta_decrypt("4D90") == "MS"
 
 def test_fanta_encrypt():
-    assert fanta_encrypt("MS") == "4D90"
\ No newline at end of file
+    assert fanta_encrypt("MS") == "4D90"
+
+def test_matches_reference():
+    rng = random.Random(0)
+    for _ in range(500):
+        data = ''.join(chr(rng.randrange(256))
+                       for _ in range(rng.randrange(64)))
+        encrypted = reference_encrypt(data)
+        assert fanta_encrypt(data) == encrypted
+        assert fanta_decrypt(encrypted) == reference_decrypt(encrypted)
+        assert fanta_decrypt(encrypted.lower()) == data
+
+def test_long_input():
+    data = 'askchaa' * 10000
+    assert fanta_decrypt(fanta_encrypt(data)) == data
+
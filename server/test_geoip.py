@@ -0,0 +1,112 @@
+import pytest
+
+pytest.importorskip('geoip2')
+
+import geoip2.errors
+import maxminddb
+
+from server.geoip import ASNLookup
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Response:
+    def __init__(self, asn):
+        self.autonomous_system_number = asn
+
+
+class Reader:
+    """Stands in for geoip2.database.Reader, counting the lookups."""
+
+    def __init__(self, asns):
+        self.asns = asns
+        self.lookups = 0
+        self.closed = False
+
+    def asn(self, address):
+        self.lookups += 1
+        if address not in self.asns:
+            raise geoip2.errors.AddressNotFoundError(address)
+        return Response(self.asns[address])
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'GeoLite2-ASN.mmdb'
+    path.write_bytes(b'v1')
+    return path
+
+
+def make_lookup(path, readers, **kwargs):
+    def open_reader(path):
+        reader = readers.pop(0)
+        if isinstance(reader, Exception):
+            raise reader
+        return reader
+    clock = Clock()
+    return ASNLookup(str(path), open_reader=open_reader, clock=clock,
+                     **kwargs), clock
+
+
+def test_cache_and_ttl(path):
+    reader = Reader({'1.1.1.1': 13335})
+    lookup, clock = make_lookup(path, [reader], ttl=10, check_interval=1000)
+
+    assert lookup.asn('1.1.1.1') == '13335'
+    assert lookup.asn('1.1.1.1') == '13335'
+    assert (lookup.hits, lookup.misses, reader.lookups) == (1, 1, 1)
+    assert lookup.hit_rate == 0.5
+
+    # Unknown addresses are cached too
+    assert lookup.asn('10.0.0.1') == ASNLookup.UNKNOWN
+    assert lookup.asn('10.0.0.1') == ASNLookup.UNKNOWN
+    assert reader.lookups == 2
+
+    clock.now += 10
+    assert lookup.asn('1.1.1.1') == '13335'
+    assert (lookup.hits, lookup.misses, reader.lookups) == (2, 3, 3)
+
+
+def test_lru_eviction(path):
+    reader = Reader({'a': 1, 'b': 2, 'c': 3})
+    lookup, clock = make_lookup(path, [reader], max_size=2,
+                                check_interval=1000)
+    lookup.asn('a')
+    lookup.asn('b')
+    lookup.asn('a')
+    lookup.asn('c')
+    assert list(lookup.cache) == ['a', 'c']
+
+
+def test_reload(path):
+    old, new = Reader({'a': 1}), Reader({'a': 2})
+    lookup, clock = make_lookup(path, [
+        old, maxminddb.InvalidDatabaseError('truncated'), new],
+        check_interval=60)
+    assert lookup.asn('a') == '1'
+
+    # A half-written file is skipped, keeping the old database and cache
+    path.write_bytes(b'v2 partial')
+    clock.now += 60
+    assert lookup.asn('a') == '1'
+    assert lookup.reader is old and not old.closed
+    assert old.lookups == 1
+
+    path.write_bytes(b'v2 complete')
+    clock.now += 60
+    assert lookup.asn('a') == '2'
+    assert old.closed
+
+    path.unlink()
+    clock.now += 60
+    assert lookup.asn('a') == ASNLookup.UNKNOWN
+    assert not lookup.available
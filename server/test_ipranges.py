@@ -0,0 +1,62 @@
+import os
+
+from server.ipranges import IPRangeMatcher
+
+RULES = [
+    '# comment',
+    '23.129.64.',
+    '104.244.7',
+    '10.0.0.0/8',
+    '192.168.1.5',
+    '2001:db8::/32',
+    'fe80:1:',
+    '',
+    '13335',
+    'not an ip',
+    '10.1.0.0/16',
+]
+
+
+def test_ranges():
+    matcher = IPRangeMatcher.from_lines(RULES)
+    assert matcher.match('23.129.64.250') == 1
+    assert matcher.match('23.129.65.1') is None
+    # Without the trailing dot, the last octet matches as a prefix
+    assert matcher.match('104.244.7.1') == 2
+    assert matcher.match('104.244.70.1') == 2
+    assert matcher.match('104.244.72.115') == 2
+    assert matcher.match('104.244.79.255') == 2
+    assert matcher.match('104.244.80.1') is None
+    assert matcher.match('104.244.8.1') is None
+    assert matcher.match('10.255.0.1') == 3
+    assert matcher.match('192.168.1.5') == 4
+    assert matcher.match('192.168.1.50') is None
+    assert matcher.match('2001:db8:1::1') == 5
+    assert matcher.match('fe80:1:2::3') == 6
+    assert matcher.match('fe80:2::3') is None
+    assert matcher.match('::ffff:23.129.64.1') == 1
+
+
+def test_first_rule_wins():
+    matcher = IPRangeMatcher.from_lines(RULES)
+    assert matcher.match('10.1.2.3') == 3
+    assert matcher.match('10.1.2.3', '13335') == 3
+    assert matcher.match('127.0.0.1', '13335') == 8
+
+
+def test_asn():
+    matcher = IPRangeMatcher.from_lines(RULES)
+    assert matcher.match('127.0.0.1', 'Loopback') is None
+    assert matcher.match('not an address', '13335') == 8
+    assert len(matcher) == 10
+
+
+def test_sample_list():
+    path = os.path.join(os.path.dirname(__file__), '..', 'config_sample',
+                        'iprange_ban.txt')
+    with open(path, encoding='utf-8') as f:
+        matcher = IPRangeMatcher.from_lines(f)
+    for address in ('104.244.72.115', '178.17.170.23', '185.100.87.41',
+                    '187.121.9.1', '23.129.64.10'):
+        assert matcher.match(address) is not None
+    assert matcher.match('104.244.8.1') is None
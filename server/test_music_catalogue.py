@@ -0,0 +1,37 @@
+import pytest
+
+from server.exceptions import ServerError
+from server.music_catalogue import MusicCatalogue
+
+MUSIC = [
+    {'use_unique_folder': False},
+    {'category': '==Trial==', 'songs': [
+        {'name': 'Objection.mp3', 'length': 60},
+        {'name': 'Cross.opus'},
+        {'name': 'no extension'},
+    ]},
+    {'category': '==Misc==', 'songs': [
+        {'name': 'Objection.mp3', 'length': 30},
+        {'name': '==Trial==', 'length': 5},
+    ]},
+]
+
+
+def test_lookup():
+    catalogue = MusicCatalogue(MUSIC)
+    assert catalogue.get('Objection.mp3') == ('Objection.mp3', 60)
+    assert catalogue.get('Cross.opus') == ('Cross.opus', -1)
+    assert catalogue.get('==Trial==') == ('==Trial==', -1)
+    assert catalogue.is_category('==Misc==')
+    assert not catalogue.is_category('Cross.opus')
+    with pytest.raises(ServerError):
+        catalogue.get('missing.mp3')
+
+
+def test_lists():
+    catalogue = MusicCatalogue(MUSIC)
+    assert catalogue.list_ao2 == ['==Trial==', 'Objection.mp3', 'Cross.opus',
+                                  '==Misc==', 'Objection.mp3']
+    assert catalogue.pages_ao1 == [['0#==Trial==', '1#Objection.mp3',
+                                    '2#Cross.opus', '3#==Misc==',
+                                    '4#Objection.mp3']]
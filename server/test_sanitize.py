@@ -0,0 +1,44 @@
+import random
+import re
+import unicodedata
+
+from server import sanitize
+
+
+def legacy_dezalgo(text, tolerance):
+    """AOProtocol.dezalgo before server.sanitize."""
+    return re.sub('([̀-ͯ᪰-᫿᷀-᷿⃐-⃿︠-︯' +
+                  'ᅟᅠㅤ]' +
+                  '{' +
+                  re.escape(str(tolerance)) + ',})',
+                  '', text)
+
+
+def test_dezalgo():
+    rng = random.Random(0)
+    alphabet = 'ab é́̀ͯ᪰⃐︠ㅤᅟ~'
+    for _ in range(2000):
+        text = ''.join(rng.choice(alphabet) for _ in range(rng.randrange(20)))
+        for tolerance in (1, 3, 5):
+            assert sanitize.dezalgo(text, tolerance) == \
+                legacy_dezalgo(text, tolerance)
+    assert sanitize.dezalgo('é́́x', None) == \
+        'é́́x'
+
+
+def test_blankposts():
+    assert sanitize.is_spammy('  ')
+    assert sanitize.is_spammy('{(~ab~)}')
+    assert not sanitize.is_spammy('abc')
+    assert not sanitize.is_spammy('>')
+    assert sanitize.visible_length('\\`|a b c') == 3
+
+
+def test_format_characters():
+    assert not sanitize.has_format_characters('Phoenix Wright')
+    assert not sanitize.has_format_characters('Naruhodō')
+    assert sanitize.has_format_characters('Phoenix​')
+    assert sanitize.has_format_characters('­soft')
+    for c in ('​', '­', 'a', 'ō'):
+        assert sanitize.has_format_characters(c) == \
+            (unicodedata.category(c) == 'Cf')
@@ -19,19 +19,23 @@ import sys
 import importlib
 import asyncio
 import websockets
-import geoip2.database
 import yaml
 import logging
 
 import server.logger
 from server import database
 from server.area_manager import AreaManager
-from server.client_manager import ClientManager
-from server.emotes import Emotes
-from server.exceptions import ClientError,ServerError
+from server.client_manager import ClientManager, encode_command
+from server.constants import ESCAPE_CHARACTERS
+from server.emotes import EmoteCache, Emotes
+from server.geoip import ASNLookup
+from server.exceptions import ServerError
+from server.ipranges import IPRangeMatcher
+from server.music_catalogue import MusicCatalogue
 from server.network.aoprotocol import AOProtocol
 from server.network.aoprotocol_ws import new_websocket_client
 from server.network.masterserverclient import MasterServerClient
+from server.network.ratelimit import Admission, RateLimiter
 
 logger = logging.getLogger('debug')
 
@@ -47,7 +51,10 @@ class TsuServer3:
         self.allowed_iniswaps = []
         self.char_list = None
         self.char_emotes = None
+        self.emote_cache = EmoteCache('storage/emote_cache.json')
+        self.emote_cache.load()
         self.char_pages_ao1 = None
+        self.music_catalogue = None
         self.music_list = []
         self.music_list_ao2 = None
         self.music_pages_ao1 = None
@@ -56,18 +63,13 @@ class TsuServer3:
         self.backgrounds_categories = None
         self.zalgo_tolerance = None
         self.mod_color = None
-        self.ipRange_bans = []
-        self.geoIpReader = None
-        self.useGeoIp = False
+        self.ipRange_bans = IPRangeMatcher()
+        self.geoip = None
         self.command_aliases = {}
-
-        try:
-            self.geoIpReader = geoip2.database.Reader('./storage/GeoLite2-ASN.mmdb')
-            self.useGeoIp = True
-            # on debian systems you can use /usr/share/GeoIP/GeoIPASNum.dat if the geoip-database-extra package is installed
-        except FileNotFoundError:
-            self.useGeoIp = False
-            pass
+        self.refreshing = False
+        # {key: (version, packet)}, see get_cached_command
+        self.command_cache = {}
+        self.command_cache_version = 0
 
         self.ms_client = None
 
@@ -96,6 +98,22 @@ class TsuServer3:
             print('Please check sample config files for the correct format.')
             sys.exit(1)
 
+        # on debian systems you can use /usr/share/GeoIP/GeoIPASNum.dat if the geoip-database-extra package is installed
+        self.geoip = ASNLookup('./storage/GeoLite2-ASN.mmdb',
+                               max_size=self.config['geoip_cache']['size'],
+                               ttl=self.config['geoip_cache']['ttl'])
+
+        limits = self.config['packet_rate_limit']
+        self.rate_limiter = RateLimiter(limits['rate'], limits['burst'],
+                                        costs=limits['costs'],
+                                        default_cost=limits['default_cost'])
+
+        admission = self.config['admission']
+        self.admission = Admission(admission['accept_rate'],
+                                   admission['accept_burst'],
+                                   admission['max_pending'],
+                                   admission['max_pending_per_address'])
+
         self.client_manager = ClientManager(self)
         server.logger.setup_logger(debug=self.config['debug'])
 
@@ -103,6 +121,7 @@ class TsuServer3:
         """Start the server."""
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
+        database.set_event_loop(loop)
 
         bound_ip = '0.0.0.0'
         if self.config['local']:
@@ -113,9 +132,10 @@ class TsuServer3:
         ao_server = loop.run_until_complete(ao_server_crt)
 
         if self.config['use_websockets']:
-            ao_server_ws = websockets.serve(new_websocket_client(self),
-                                            bound_ip,
-                                            self.config['websocket_port'])
+            ao_server_ws = websockets.serve(
+                new_websocket_client(self), bound_ip,
+                self.config['websocket_port'],
+                max_size=self.config['websocket_limits']['max_size'])
             asyncio.ensure_future(ao_server_ws)
 
         if self.config['use_masterserver']:
@@ -133,6 +153,10 @@ class TsuServer3:
 
         asyncio.ensure_future(self.schedule_unbans())
 
+        writer = self.config['database_writer']
+        database.start_writer(queue_size=writer['queue_size'],
+                              batch_rows=writer['batch_rows'],
+                              batch_interval=writer['batch_interval'] / 1000)
         database.log_misc('start')
         print('Server started and is listening on port {}'.format(
             self.config['port']))
@@ -143,6 +167,12 @@ class TsuServer3:
             pass
 
         database.log_misc('stop')
+        database.stop_writer()
+        self.emote_cache.save()
+        logger.debug(f'GeoIP cache: {self.geoip.hits} hits, '
+                     f'{self.geoip.misses} misses ({self.geoip.hit_rate:.0%})')
+        logger.debug(f'Rate limiter: {self.rate_limiter.dropped} packets dropped, '
+                     f'{self.admission.rejected} connections rejected')
 
         ao_server.close()
         loop.run_until_complete(ao_server.wait_closed())
@@ -150,7 +180,7 @@ class TsuServer3:
 
     async def schedule_unbans(self):
         while True:
-            database.schedule_unbans()
+            await database.aio.schedule_unbans()
             await asyncio.sleep(3600 * 12)
          
     async def idle_loop(self):
@@ -166,46 +196,32 @@ class TsuServer3:
     def new_client(self, transport):
         """
         Create a new client based on a raw transport by passing
-        it to the client manager.
+        it to the client manager. The client only joins its area once
+        it completes the handshake (see AOProtocol.finish_handshake).
         :param transport: asyncio transport
         :returns: created client object
         """
-        peername = transport.get_extra_info('peername')[0]
-
-        if self.useGeoIp:
-            try:
-                geoIpResponse = self.geoIpReader.asn(peername)
-                asn = str(geoIpResponse.autonomous_system_number)
-            except geoip2.errors.AddressNotFoundError:
-                asn = "Loopback"
-                pass
-        else:
-            asn = "Loopback"
-
-        for line,rangeBan in enumerate(self.ipRange_bans):
-            if rangeBan != "" and peername.startswith(rangeBan) or asn == rangeBan:
-                msg =   'BD#'
-                msg +=  'Abuse\r\n'
-                msg += f'ID: {line}\r\n'
-                msg +=  'Until: N/A'
-                msg +=  '#%'
-
-                transport.write(msg.encode('utf-8'))
-                raise ClientError
-
         c = self.client_manager.new_client(transport)
         c.server = self
         c.area = self.area_manager.default_area()
-        c.area.new_client(c)
         return c
 
+    def ip_range_ban(self, address):
+        """
+        Find the rule of iprange_ban.txt that bans an address, if any.
+        :param address: IP address
+        :returns: line of the rule, or None
+        """
+        return self.ipRange_bans.match(address, self.geoip.asn(address))
+
     def remove_client(self, client):
         """
         Remove a disconnected client.
         :param client: client object
 
         """
-        client.area.remove_client(client)
+        if client in client.area.clients:
+            client.area.remove_client(client)
         self.client_manager.remove_client(client)
 
     @property
@@ -261,28 +277,94 @@ class TsuServer3:
             self.config['default_ban_duration'] = '6 hours'
         if 'asset_url' not in self.config:
             self.config['asset_url'] = None
+        if 'outbound_buffer' not in self.config:
+            self.config['outbound_buffer'] = {}
+        self.config['outbound_buffer'].setdefault('high_water', 65536)
+        self.config['outbound_buffer'].setdefault('low_water', 16384)
+        self.config['outbound_buffer'].setdefault('max_backlog', 1048576)
+        if 'geoip_cache' not in self.config:
+            self.config['geoip_cache'] = {}
+        self.config['geoip_cache'].setdefault('size', 4096)
+        self.config['geoip_cache'].setdefault('ttl', 3600)
+        if 'database_writer' not in self.config:
+            self.config['database_writer'] = {}
+        self.config['database_writer'].setdefault('queue_size', 10000)
+        self.config['database_writer'].setdefault('batch_rows', 500)
+        self.config['database_writer'].setdefault('batch_interval', 250)
+        if 'websocket_limits' not in self.config:
+            self.config['websocket_limits'] = {}
+        self.config['websocket_limits'].setdefault('max_size', 8192)
+        self.config['websocket_limits'].setdefault('messages_per_second', 10)
+        self.config['websocket_limits'].setdefault('burst', 30)
+        if 'packet_rate_limit' not in self.config:
+            self.config['packet_rate_limit'] = {}
+        self.config['packet_rate_limit'].setdefault('rate', 15)
+        self.config['packet_rate_limit'].setdefault('burst', 60)
+        self.config['packet_rate_limit'].setdefault('default_cost', 1)
+        # AO1 clients ask for the character and music lists page by page
+        costs = {'CH': 0, 'AN': 0, 'AE': 0, 'AM': 0, 'CT': 2, 'PE': 3,
+                 'EE': 3, 'DE': 3, 'HP': 3, 'ZZ': 10, 'CASEA': 10}
+        costs.update(self.config['packet_rate_limit'].get('costs') or {})
+        self.config['packet_rate_limit']['costs'] = costs
+        if 'admission' not in self.config:
+            self.config['admission'] = {}
+        self.config['admission'].setdefault('accept_rate', 1)
+        self.config['admission'].setdefault('accept_burst', 16)
+        self.config['admission'].setdefault('max_pending', 64)
+        self.config['admission'].setdefault('max_pending_per_address', 4)
+        self.config['admission'].setdefault('handshake_timeout', 15)
 
     def load_command_aliases(self):
         """Load a list of alternative command names."""
+        command_aliases = self.read_command_aliases()
+        if command_aliases is not None:
+            self.command_aliases = command_aliases
+
+    @staticmethod
+    def read_command_aliases():
         try:
             with open(
                 "config/command_aliases.yaml", "r", encoding="utf-8"
             ) as command_aliases:
-                self.command_aliases = yaml.safe_load(command_aliases)
+                return yaml.safe_load(command_aliases)
         except Exception:
             logger.debug("Cannot find command_aliases.yaml")
+            return None
 
     def load_characters(self):
         """Load the character list from a YAML file."""
+        self.set_characters(self.read_characters())
+        self.emote_cache.save()
+
+    @staticmethod
+    def read_characters():
         with open('config/characters.yaml', 'r', encoding='utf-8') as chars:
-            self.char_list = yaml.safe_load(chars)
+            return yaml.safe_load(chars)
+
+    def set_characters(self, char_list):
+        self.char_list = char_list
         self.build_char_pages_ao1()
-        self.char_emotes = {char: Emotes(char) for char in self.char_list}
+        # Emotes are read when a character is first used, so only forget
+        # the cached emotes of the characters that were removed
+        self.emote_cache.prune(self.char_list)
+        self.char_emotes = {char: Emotes(char, self.emote_cache)
+                            for char in self.char_list}
+        self.invalidate_command_cache()
 
     def load_music(self):
-        self.build_music_list()
-        self.music_pages_ao1 = self.build_music_pages_ao1(self.music_list)
-        self.music_list_ao2 = self.build_music_list_ao2(self.music_list)
+        self.set_music(self.read_music())
+
+    @staticmethod
+    def read_music():
+        with open('config/music.yaml', 'r', encoding='utf-8') as music:
+            return MusicCatalogue(yaml.safe_load(music))
+
+    def set_music(self, catalogue):
+        self.music_catalogue = catalogue
+        self.music_list = catalogue.music_list
+        self.music_pages_ao1 = catalogue.pages_ao1
+        self.music_list_ao2 = catalogue.list_ao2
+        self.invalidate_command_cache()
         
     def load_gimps(self):
         with open('config/gimp.yaml', 'r', encoding='utf-8') as gmp:
@@ -290,34 +372,50 @@ class TsuServer3:
 
     def load_backgrounds(self):
         """Load the backgrounds list from a YAML file."""
+        self.backgrounds_categories, self.backgrounds = self.read_backgrounds()
+
+    @staticmethod
+    def read_backgrounds():
         with open("config/backgrounds.yaml", "r", encoding="utf-8") as bgs:
             bg_yaml = yaml.safe_load(bgs)
             # old style of backgrounds.yaml
             if type(bg_yaml) is list:
-                self.backgrounds_categories = {"backgrounds": bg_yaml}
-                self.backgrounds = bg_yaml
+                return {"backgrounds": bg_yaml}, bg_yaml
             # new style of categorized backgrounds.yaml
             else:
-                self.backgrounds_categories = bg_yaml
-                self.backgrounds = sum(list(self.backgrounds_categories.values()), [])
+                return bg_yaml, sum(list(bg_yaml.values()), [])
 
     def load_iniswaps(self):
         """Load a list of characters for which INI swapping is allowed."""
+        allowed_iniswaps = self.read_iniswaps()
+        if allowed_iniswaps is not None:
+            self.allowed_iniswaps = allowed_iniswaps
+
+    @staticmethod
+    def read_iniswaps():
         try:
             with open('config/iniswaps.yaml', 'r',
                       encoding='utf-8') as iniswaps:
-                self.allowed_iniswaps = yaml.safe_load(iniswaps)
+                return yaml.safe_load(iniswaps)
         except:
             logger.debug('Cannot find iniswaps.yaml')
+            return None
 
     def load_ipranges(self):
         """Load a list of banned IP ranges."""
+        ipranges = self.read_ipranges()
+        if ipranges is not None:
+            self.ipRange_bans = ipranges
+
+    @staticmethod
+    def read_ipranges():
         try:
             with open('config/iprange_ban.txt', 'r',
                       encoding='utf-8') as ipranges:
-                self.ipRange_bans = ipranges.read().splitlines()
+                return IPRangeMatcher.from_lines(ipranges.read().splitlines())
         except:
             logger.debug('Cannot find iprange_ban.txt')
+            return None
 
     def build_char_pages_ao1(self):
         """
@@ -331,43 +429,45 @@ class TsuServer3:
             self.char_pages_ao1[i // 10][i % 10] = '{}#{}&&0&&&0&'.format(
                 i, self.char_list[i])
 
-    def build_music_list(self):
-        with open('config/music.yaml', 'r', encoding='utf-8') as music:
-            self.music_list = yaml.safe_load(music)
+    def get_escaped_char_list(self):
+        """Get the character list with the characters reserved by the
+        protocol replaced, as sent in the SC packet."""
+        escaped = []
+        for char in self.char_list:
+            for esc, replacement in ESCAPE_CHARACTERS.items():
+                char = char.replace(esc, replacement)
+            escaped.append(char)
+        return escaped
+
+    def get_cached_command(self, key, build):
+        """
+        Get an encoded packet that is the same for every client, such as
+        the character or music lists sent during the handshake.
+        The packet is built and encoded on first use, and then reused until
+        invalidate_command_cache is called.
+        :param key: hashable key of the packet, e.g. 'SC' or ('CI', 0)
+        :param build: function returning the command and its arguments
+        :returns: the encoded packet
+        """
+        cached = self.command_cache.get(key)
+        if cached is None or cached[0] != self.command_cache_version:
+            cached = (self.command_cache_version, encode_command(*build()))
+            self.command_cache[key] = cached
+        return cached[1]
+
+    def invalidate_command_cache(self):
+        """
+        Rebuild the cached packets on next use. Must be called whenever the
+        characters, music or areas change.
+        """
+        self.command_cache_version += 1
+        self.command_cache.clear()
 
     def build_music_pages_ao1(self, music_list):
-        song_list = []
-        index = 0
-        for item in music_list:
-            if 'category' not in item:
-                continue
-            song_list.append('{}#{}'.format(index, item['category']))
-            index += 1
-            for song in item['songs']:
-                if self._is_valid_song_name(song['name']):
-                    song_list.append('{}#{}'.format(index, song['name']))
-                    index += 1
-                else:
-                    logger.debug(f"{song['name']} is not a valid song name")
-        song_list = [song_list[x:x + 10] for x in range(0, len(song_list), 10)]
-        return song_list
+        return self._music_catalogue(music_list).pages_ao1
 
     def build_music_list_ao2(self, music_list):
-        song_list = []
-        for item in music_list:
-            if 'category' not in item: #skip settings n stuff
-                continue
-            song_list.append(item['category'])
-            for song in item['songs']:
-                if self._is_valid_song_name(song['name']):
-                    song_list.append(song['name'])
-                else:
-                    logger.debug(f"{song['name']} is not a valid song name")
-        return song_list
-
-    @staticmethod
-    def _is_valid_song_name(song_name: str) -> bool:
-        return '.' in song_name
+        return self._music_catalogue(music_list).list_ao2
 
     def is_valid_char_id(self, char_id):
         """
@@ -398,18 +498,7 @@ class TsuServer3:
         :returns: tuple (name, length or -1)
         :raises: ServerError if track not found
         """
-        for item in music_list:
-            if 'category' not in item: #skip settings n stuff
-                continue
-            if item['category'] == music:
-                return item['category'], -1
-            for song in item['songs']:
-                if song['name'] == music:
-                    try:
-                        return song['name'], song['length']
-                    except KeyError:
-                        return song['name'], -1
-        raise ServerError('Music not found.')
+        return self._music_catalogue(music_list).get(music)
 
     def get_song_is_category(self, music_list, music):
         """
@@ -418,21 +507,24 @@ class TsuServer3:
         :param music: track name
         :returns: bool
         """
-        for item in music_list:
-            if 'category' not in item: #skip settings n stuff
-                continue
-            if item['category'] == music:
-                return True
-        return False
-    
+        return self._music_catalogue(music_list).is_category(music)
+
+    def _music_catalogue(self, music_list):
+        if self.music_catalogue is not None and \
+                music_list is self.music_catalogue.music_list:
+            return self.music_catalogue
+        return MusicCatalogue(music_list)
+
     def send_all_cmd_pred(self, cmd, *args, pred=lambda x: True):
         """
         Broadcast an AO-compatible command to all clients that satisfy
-        a predicate.
+        a predicate. Clients that have not finished the handshake are
+        skipped.
         """
-        for client in self.client_manager.clients:
-            if pred(client):
-                client.send_command(cmd, *args)
+        self.client_manager.send_command_to(
+            [client for client in self.client_manager.clients
+             if client.is_checked and pred(client)],
+            cmd, *args)
 
     def broadcast_global(self, client, msg, as_mod=False):
         """
@@ -484,43 +576,7 @@ class TsuServer3:
             '1',
             pred=lambda x: not x.muted_adverts)
 
-    def send_arup(self, args):
-        """Update the area properties for 2.6 clients.
-
-        Playercount:
-            ARUP#0#<area1_p: int>#<area2_p: int>#...
-        Status:
-            ARUP#1##<area1_s: string>##<area2_s: string>#...
-        CM:
-            ARUP#2##<area1_cm: string>##<area2_cm: string>#...
-        Lockedness:
-            ARUP#3##<area1_l: string>##<area2_l: string>#...
-
-        :param args:
-
-        """
-        if len(args) < 2:
-            # An argument count smaller than 2 means we only got the identifier of ARUP.
-            return
-        if args[0] not in (0, 1, 2, 3):
-            return
-
-        if args[0] == 0:
-            for part_arg in args[1:]:
-                try:
-                    _sanitised = int(part_arg)
-                except:
-                    return
-        elif args[0] in (1, 2, 3):
-            for part_arg in args[1:]:
-                try:
-                    _sanitised = str(part_arg)
-                except:
-                    return
-
-        self.send_all_cmd_pred('ARUP', *args, pred=lambda x: True)
-
-    def refresh(self):
+    async def refresh_async(self):
         """
         Refresh as many parts of the server as possible:
          - MOTD
@@ -530,38 +586,79 @@ class TsuServer3:
          - Backgrounds
          - Commands
          - Banlists
+        The files are read and compiled in a worker thread, so that
+        clients are not held up while it happens.
+        :raises: ServerError if a refresh is already in progress
+        """
+        if self.refreshing:
+            raise ServerError('The server is already being refreshed.')
+        self.refreshing = True
+        try:
+            loop = asyncio.get_event_loop()
+            data = await loop.run_in_executor(None, self.read_refresh)
+            self.apply_refresh(data)
+            await loop.run_in_executor(None, self.emote_cache.save)
+        finally:
+            self.refreshing = False
+
+    def read_refresh(self):
         """
-        with open('config/config.yaml', 'r') as cfg:
+        Read and compile everything that is reloaded by refresh_async.
+        This only reads files and does not change the server, so it
+        may run outside of the event loop.
+        :returns: dict to pass to apply_refresh
+        """
+        with open('config/config.yaml', 'r', encoding='utf-8') as cfg:
             cfg_yaml = yaml.safe_load(cfg)
-            self.config['motd'] = cfg_yaml['motd'].replace('\\n', ' \n')
-
-            # Reload moderator passwords list and unmod any moderator affected by
-            # credential changes or removals
-            if isinstance(self.config['modpass'], str):
-                self.config['modpass'] = {'default': {'password': self.config['modpass']}}
-            if isinstance(cfg_yaml['modpass'], str):
-                cfg_yaml['modpass'] = {'default': {'password': cfg_yaml['modpass']}}
-
-            for profile in self.config['modpass']:
-                if profile not in cfg_yaml['modpass'] or \
-                   self.config['modpass'][profile] != cfg_yaml['modpass'][profile]:
-                    for client in filter(
-                            lambda c: c.mod_profile_name == profile,
-                            self.client_manager.clients):
-                        client.is_mod = False
-                        client.mod_profile_name = None
-                        database.log_misc('unmod.modpass', client)
-                        client.send_ooc(
-                            'Your moderator credentials have been revoked.')
-                        client.send_command('AUTH', '-1')
-            self.config['modpass'] = cfg_yaml['modpass']
-
-        self.load_command_aliases()
-        self.load_characters()
-        self.load_iniswaps()
-        self.load_music()
-        self.load_backgrounds()
-        self.load_ipranges()
+        return {
+            'config': cfg_yaml,
+            'command_aliases': self.read_command_aliases(),
+            'char_list': self.read_characters(),
+            'allowed_iniswaps': self.read_iniswaps(),
+            'music': self.read_music(),
+            'backgrounds': self.read_backgrounds(),
+            'ipranges': self.read_ipranges()
+        }
+
+    def apply_refresh(self, data):
+        """
+        Swap in everything loaded by read_refresh at once, so that
+        clients never see a partially refreshed server.
+        :param data: dict returned by read_refresh
+        """
+        cfg_yaml = data['config']
+        self.config['motd'] = cfg_yaml['motd'].replace('\\n', ' \n')
+
+        # Reload moderator passwords list and unmod any moderator affected by
+        # credential changes or removals
+        if isinstance(self.config['modpass'], str):
+            self.config['modpass'] = {'default': {'password': self.config['modpass']}}
+        if isinstance(cfg_yaml['modpass'], str):
+            cfg_yaml['modpass'] = {'default': {'password': cfg_yaml['modpass']}}
+
+        for profile in self.config['modpass']:
+            if profile not in cfg_yaml['modpass'] or \
+               self.config['modpass'][profile] != cfg_yaml['modpass'][profile]:
+                for client in filter(
+                        lambda c: c.mod_profile_name == profile,
+                        self.client_manager.clients):
+                    client.is_mod = False
+                    client.mod_profile_name = None
+                    database.log_misc('unmod.modpass', client)
+                    client.send_ooc(
+                        'Your moderator credentials have been revoked.')
+                    client.send_command('AUTH', '-1')
+        self.config['modpass'] = cfg_yaml['modpass']
+
+        if data['command_aliases'] is not None:
+            self.command_aliases = data['command_aliases']
+        self.set_characters(data['char_list'])
+        if data['allowed_iniswaps'] is not None:
+            self.allowed_iniswaps = data['allowed_iniswaps']
+        self.set_music(data['music'])
+        self.backgrounds_categories, self.backgrounds = data['backgrounds']
+        if data['ipranges'] is not None:
+            self.ipRange_bans = data['ipranges']
 
         import server.commands
         importlib.reload(server.commands)